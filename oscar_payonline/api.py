@@ -0,0 +1,198 @@
+import hashlib
+import logging
+import random
+import threading
+import time
+
+try:
+    from urlparse import parse_qsl
+except ImportError:
+    from urllib.parse import parse_qsl
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.encoding import force_bytes
+
+try:
+    import requests
+    from requests.adapters import HTTPAdapter
+except ImportError:
+    requests = None
+
+from payonline.settings import CONFIG as PAYONLINE_CONFIG
+
+from .exceptions import PayOnlineAPIError, PayOnlineAPIUnavailable
+from .instrumentation import timed
+
+logger = logging.getLogger('payonline')
+
+API_SEARCH_URL = getattr(settings, 'OSCAR_PAYONLINE_API_SEARCH_URL',
+                         'https://secure.payonlinesystem.com/payment/search/')
+# (connect, read) timeouts in seconds
+API_TIMEOUT = getattr(settings, 'OSCAR_PAYONLINE_API_TIMEOUT', (3, 10))
+API_RETRIES = getattr(settings, 'OSCAR_PAYONLINE_API_RETRIES', 2)
+API_RETRY_BACKOFF = getattr(settings, 'OSCAR_PAYONLINE_API_RETRY_BACKOFF', 0.2)
+API_POOL_SIZE = getattr(settings, 'OSCAR_PAYONLINE_API_POOL_SIZE', 10)
+# circuit opens after so many failed requests in a row and stays open for reset timeout seconds
+API_BREAKER_THRESHOLD = getattr(settings, 'OSCAR_PAYONLINE_API_BREAKER_THRESHOLD', 5)
+API_BREAKER_RESET_TIMEOUT = getattr(settings, 'OSCAR_PAYONLINE_API_BREAKER_RESET_TIMEOUT', 30)
+
+
+class CircuitBreaker(object):
+
+    def __init__(self, threshold=API_BREAKER_THRESHOLD, reset_timeout=API_BREAKER_RESET_TIMEOUT):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            # half-open: let one request through to probe the service
+            if time.time() - self.opened_at >= self.reset_timeout:
+                self.opened_at = time.time()
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                if self.opened_at is None:
+                    logger.error("PayOnline API circuit opened after %s failures", self.failures)
+                self.opened_at = time.time()
+
+
+class RateLimiter(object):
+    """
+    Token bucket shared by threads, allows `rate` requests per second
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.time()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class PayonlineClient(object):
+    """
+    PayOnline API client keeping connections alive in a pooled session,
+    so verification costs one round trip instead of a new TLS handshake.
+    Thread-safe, use get_client() to share it across the process.
+    """
+
+    def __init__(self, search_url=API_SEARCH_URL, merchant_id=None, private_security_key=None,
+                 timeout=API_TIMEOUT, retries=API_RETRIES, backoff=API_RETRY_BACKOFF,
+                 pool_size=API_POOL_SIZE, breaker=None):
+        if requests is None:
+            raise ImproperlyConfigured("PayOnline API client requires 'requests' package")
+        self.search_url = search_url
+        self.merchant_id = merchant_id or PAYONLINE_CONFIG['MERCHANT_ID']
+        self.private_security_key = private_security_key or PAYONLINE_CONFIG['PRIVATE_SECURITY_KEY']
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+        self.session = requests.Session()
+        # retries are ours, with jitter and breaker accounting
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def get_security_key(self, ref):
+        data = 'MerchantId=%s&OrderId=%s&PrivateSecurityKey=%s' % (
+            self.merchant_id, ref, self.private_security_key)
+        return hashlib.md5(force_bytes(data)).hexdigest()
+
+    def parse_response(self, content):
+        """
+        Text responses have one transaction per line as url-encoded pairs
+        """
+        transactions = []
+        for line in content.splitlines():
+            line = line.strip()
+            if line:
+                transactions.append(dict(parse_qsl(line)))
+        return transactions
+
+    def request(self, params):
+        if not self.breaker.allow():
+            raise PayOnlineAPIUnavailable("PayOnline API circuit is open")
+        attempt = 0
+        while True:
+            try:
+                with timed('api.request'):
+                    response = self.session.get(self.search_url, params=params, timeout=self.timeout)
+                if response.status_code >= 500:
+                    raise PayOnlineAPIError("PayOnline API responded with %s" % response.status_code)
+            except (requests.RequestException, PayOnlineAPIError) as e:
+                self.breaker.failure()
+                if attempt >= self.retries or not self.breaker.allow():
+                    raise PayOnlineAPIUnavailable("PayOnline API request failed: %s" % e)
+                # exponential backoff with jitter, so retries of many workers spread out
+                time.sleep(self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5))
+                attempt += 1
+                continue
+            self.breaker.success()
+            if response.status_code != 200:
+                raise PayOnlineAPIError("PayOnline API responded with %s: %s" % (
+                    response.status_code, response.text[:200]))
+            return response.text
+
+    def search(self, ref):
+        """
+        Returns list of PayOnline transactions for the merchant reference
+        """
+        params = {
+            'MerchantId': self.merchant_id,
+            'OrderId': ref,
+            'SecurityKey': self.get_security_key(ref),
+            'ContentType': 'text',
+        }
+        return self.parse_response(self.request(params))
+
+    def get_transaction(self, ref, transaction_id=None):
+        """
+        Returns PayOnline transaction of the merchant reference with the given id
+        (or the first one) or None. A reference may have many transactions,
+        e.g. declined attempts before the paid one
+        """
+        transactions = self.search(ref)
+        if transaction_id is not None:
+            transactions = [txn for txn in transactions if txn.get('Id') == str(transaction_id)]
+        return transactions[0] if transactions else None
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = PayonlineClient()
+    return _client
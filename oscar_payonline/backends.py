@@ -0,0 +1,95 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .instrumentation import timed, get_backend_name
+
+try:
+    from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+except ImportError:
+    # 'futures' backport is not installed, so every backend is called synchronously
+    ThreadPoolExecutor = None
+
+logger = logging.getLogger('payonline')
+
+SYNC, THREADED, DEFERRED = 'sync', 'threaded', 'deferred'
+
+# Success/fail backends execution.
+#  - sync: called inline one after another
+#  - threaded: called concurrently on the pool, the caller waits up to the timeout
+#  - deferred: submitted to the pool, the caller does not wait
+# Options per backend are set by its dotted path, e.g.
+# OSCAR_PAYONLINE_BACKEND_OPTIONS = {'myshop.payment.notify_erp': {'mode': 'deferred'}}
+BACKEND_MODE = getattr(settings, 'OSCAR_PAYONLINE_BACKEND_MODE', SYNC)
+BACKEND_TIMEOUT = getattr(settings, 'OSCAR_PAYONLINE_BACKEND_TIMEOUT', 10)
+BACKEND_OPTIONS = getattr(settings, 'OSCAR_PAYONLINE_BACKEND_OPTIONS', {})
+BACKEND_POOL_SIZE = getattr(settings, 'OSCAR_PAYONLINE_BACKEND_POOL_SIZE', 4)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    if ThreadPoolExecutor is None:
+        return None
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=BACKEND_POOL_SIZE)
+    return _executor
+
+
+class BackendRunner(object):
+    """
+    Calls payonline success or fail backends isolating their errors,
+    so one broken backend can't break the callback or other backends
+    """
+
+    def __init__(self, kind):
+        self.kind = kind
+
+    def get_options(self, name):
+        options = BACKEND_OPTIONS.get(name, {})
+        return options.get('mode', BACKEND_MODE), options.get('timeout', BACKEND_TIMEOUT)
+
+    def run(self, backends, *args):
+        waiting = []
+        for backend in backends:
+            name = get_backend_name(backend)
+            mode, timeout = self.get_options(name)
+            executor = get_executor() if mode != SYNC else None
+            if executor is None:
+                if mode != SYNC:
+                    logger.warning("Can't run backend %s in %s mode: 'futures' is not installed", name, mode)
+                self.call(name, backend, args, timeout)
+                continue
+            future = executor.submit(self.call, name, backend, args, timeout, True)
+            if mode == THREADED:
+                waiting.append((name, future, time.time() + timeout))
+        for name, future, deadline in waiting:
+            try:
+                future.result(timeout=max(deadline - time.time(), 0))
+            except FutureTimeoutError:
+                logger.error("Payonline %s backend %s timed out. Left running in background",
+                             self.kind, name)
+
+    def call(self, name, backend, args, timeout, in_pool=False):
+        start = time.time()
+        try:
+            with timed('backend.%s.%s' % (self.kind, name)):
+                backend(*args)
+        except Exception:
+            logger.exception("Payonline %s backend %s failed", self.kind, name)
+            return False
+        finally:
+            if in_pool:
+                close_old_connections()
+        duration = time.time() - start
+        if duration > timeout:
+            logger.warning("Payonline %s backend %s is too slow: %.3fs (timeout %ss)",
+                           self.kind, name, duration, timeout)
+        return True
@@ -0,0 +1,43 @@
+from django.utils import translation
+from django.utils.encoding import force_text
+from django.utils.translation import ugettext_lazy as _
+
+from payonline.helpers import APIErrors
+
+UNKNOWN_ERROR = _("Unknown error (code %(code)s)")
+
+
+class ErrorCatalogue(object):
+    """
+    PayOnline error messages built once and translated once per language.
+    Unknown codes are not memoized as they come from requests
+    """
+
+    def __init__(self):
+        self._errors = None
+        # language -> {code: message}
+        self._messages = {}
+
+    @property
+    def errors(self):
+        if self._errors is None:
+            self._errors = APIErrors()
+        return self._errors
+
+    def get(self, code):
+        code = str(code)
+        messages = self._messages.get(translation.get_language())
+        if messages is None:
+            messages = self._messages.setdefault(translation.get_language(), {})
+        message = messages.get(code)
+        if message is None:
+            message = self.errors.get(code)
+            if message is None and code.isdigit():
+                message = self.errors.get(int(code))
+            if message is None:
+                return force_text(UNKNOWN_ERROR) % {'code': code}
+            message = messages[code] = force_text(message)
+        return message
+
+
+error_catalogue = ErrorCatalogue()
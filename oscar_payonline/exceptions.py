@@ -15,3 +15,11 @@ class MissingShippingAddressException(Exception):
 
 class MissingShippingMethodException(Exception):
     pass
+
+
+class PayOnlineAPIError(PayOnlineError):
+    pass
+
+
+class PayOnlineAPIUnavailable(PayOnlineAPIError):
+    pass
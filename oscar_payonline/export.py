@@ -0,0 +1,125 @@
+import csv
+from datetime import timedelta
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import dateparse
+from django.utils.encoding import smart_str
+
+from oscar.core.loading import get_model
+
+from payonline.models import PaymentData
+
+from .facade import PayonlineFacade
+from .registry import registry
+
+PaymentEvent = get_model('order', 'PaymentEvent')
+Source = get_model('payment', 'Source')
+
+FIELDS = (
+    'transaction_id', 'merchant_reference', 'datetime', 'amount', 'currency', 'provider',
+    'order_number', 'order_status', 'order_total_incl_tax', 'order_date_placed',
+    'amount_debited', 'payment_event_date',
+)
+
+
+def parse_date(value):
+    """
+    Parses YYYY-MM-DD bound of the exported range, None for empty value.
+    Raises ValueError for malformed dates, so a typo does not export everything
+    """
+    if not value:
+        return None
+    date = dateparse.parse_date(value)
+    if date is None:
+        raise ValueError("Invalid date: %s" % value)
+    return date
+
+
+def iter_transactions(date_from=None, date_to=None, status=None, chunk_size=1000):
+    """
+    Yields PaymentData rows joined to Oscar's order, payment source and
+    'payonline-successful' event as dicts.
+    Rows are fetched in keyset-paginated chunks with two extra queries per chunk,
+    so memory is constant whatever the date range is.
+    date_to is inclusive, status filters by current order status.
+    """
+    facade = PayonlineFacade()
+    event_types = (registry.get_event_type(facade.EVENT_CODE_REDIRECTED).pk,
+                   registry.get_event_type(facade.EVENT_CODE_SUCCESSFUL).pk)
+    successful = event_types[1]
+    transactions = PaymentData.objects.all()
+    if date_from:
+        transactions = transactions.filter(datetime__gte=date_from)
+    if date_to:
+        transactions = transactions.filter(datetime__lt=date_to + timedelta(days=1))
+
+    last_pk = 0
+    while True:
+        chunk = list(transactions.filter(pk__gt=last_pk).order_by('pk')[:chunk_size])
+        if not chunk:
+            break
+        last_pk = chunk[-1].pk
+        refs = [txn.order_id for txn in chunk]
+
+        orders, payment_dates = {}, {}
+        events = PaymentEvent.objects.filter(
+            reference__in=refs, event_type_id__in=event_types).select_related('order')
+        for event in events:
+            orders.setdefault(event.reference, event.order)
+            if event.event_type_id == successful:
+                payment_dates[event.reference] = event.date_created
+        sources = dict((source.reference, source) for source in Source.objects.filter(reference__in=refs))
+
+        for txn in chunk:
+            ref = txn.order_id
+            order = orders.get(ref)
+            if status and (order is None or order.status != status):
+                continue
+            source = sources.get(ref)
+            yield {
+                'transaction_id': txn.transaction_id,
+                'merchant_reference': ref,
+                'datetime': txn.datetime,
+                'amount': txn.amount,
+                'currency': txn.currency,
+                'provider': txn.provider,
+                'order_number': order.number if order else None,
+                'order_status': order.status if order else None,
+                'order_total_incl_tax': order.total_incl_tax if order else None,
+                'order_date_placed': order.date_placed if order else None,
+                'amount_debited': source.amount_debited if source else None,
+                'payment_event_date': payment_dates.get(ref),
+            }
+
+
+class Echo(object):
+    """
+    File-like object returning written value, so csv writer output can be streamed
+    """
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(FIELDS)
+    for row in rows:
+        yield writer.writerow([smart_str(row[field]) if row[field] is not None else ''
+                               for field in FIELDS])
+
+
+def json_lines(rows):
+    encoder = DjangoJSONEncoder()
+    yield '['
+    separator = '\n'
+    for row in rows:
+        yield separator + encoder.encode(row)
+        separator = ',\n'
+    yield '\n]\n'
+
+
+WRITERS = {
+    'csv': (csv_lines, 'text/csv'),
+    'json': (json_lines, 'application/json'),
+}
@@ -1,7 +1,12 @@
-import random
+import hashlib
+import logging
+from decimal import Decimal as D, InvalidOperation
 
 from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction, DEFAULT_DB_ALIAS
 from django.core.urlresolvers import reverse
+from django.utils.encoding import force_bytes
 from django.shortcuts import get_object_or_404
 from django.utils.translation import ugettext_lazy as _
 
@@ -10,15 +15,26 @@ from oscar.apps.payment.exceptions import UnableToTakePayment, InvalidGatewayReq
 
 from payonline.settings import CONFIG as PAYONLINE_CONFIG
 from payonline.models import PaymentData
-from payonline.helpers import APIErrors
 
-from .exceptions import PayOnlineError
+from .api import get_client, RateLimiter
+from .backends import ThreadPoolExecutor
+from .errors import error_catalogue
+from .exceptions import PayOnlineError, PayOnlineAPIError
+from .instrumentation import instrumented
+from .references import get_reference_generator
+from .registry import registry
 
 Basket = get_model('basket', 'Basket')
 Order = get_model('order', 'Order')
 PaymentEvent = get_model('order', 'PaymentEvent')
 Applicator = get_class('offer.utils', 'Applicator')
 Selector = get_class('partner.strategy', 'Selector')
+ConditionalOffer = get_model('offer', 'ConditionalOffer')
+Voucher = get_model('voucher', 'Voucher')
+OfferApplications = get_class('offer.results', 'OfferApplications')
+EventHandler = get_class('order.processing', 'EventHandler')
+
+logger = logging.getLogger('payonline')
 
 # as we now have payment processing after the order placement
 # some additional options required to check if we can start the process or not
@@ -29,6 +45,72 @@ FAILED_PAYONLINE_STATUS = getattr(settings, 'OSCAR_FAILED_PAYONLINE_STATUS', 'Fa
 SUCCESSFUL_PAYONLINE_STATUS = getattr(settings, 'OSCAR_SUCCESSFUL_PAYONLINE_STATUS', 'Successful payment')
 INITIAL_PAYONLINE_STATUS = getattr(settings, 'OSCAR_INITIAL_PAYONLINE_STATUS', settings.OSCAR_INITIAL_ORDER_STATUS)
 
+# frozen order lookups are cached per user as the middleware asks for them on every page.
+# we store an order id or NO_FROZEN_ORDER marker, so users without frozen orders cost nothing
+FROZEN_ORDER_CACHE_TIMEOUT = getattr(settings, 'OSCAR_PAYONLINE_FROZEN_ORDER_CACHE_TIMEOUT', 60 * 15)
+FROZEN_ORDER_CACHE_KEY = 'payonline-frozen-order-%s'
+NO_FROZEN_ORDER = 'none'
+# status changes leave FROZEN_ORDER_INVALIDATED marker for a few seconds,
+# so a lookup that read the old status can't cache NO_FROZEN_ORDER over it
+FROZEN_ORDER_INVALIDATED_TIMEOUT = getattr(settings, 'OSCAR_PAYONLINE_FROZEN_ORDER_INVALIDATED_TIMEOUT', 10)
+FROZEN_ORDER_INVALIDATED = 'invalidated'
+
+# PaymentData lookups by merchant reference on the success page
+TRANSACTION_CACHE_TIMEOUT = getattr(settings, 'OSCAR_PAYONLINE_TRANSACTION_CACHE_TIMEOUT', 60 * 60)
+TRANSACTION_MISSING_CACHE_TIMEOUT = getattr(settings, 'OSCAR_PAYONLINE_TRANSACTION_MISSING_CACHE_TIMEOUT', 5)
+TRANSACTION_CACHE_KEY = 'payonline-txn-%s'
+NO_TRANSACTION = 'none'
+
+# database alias of read replica for safe reads (frozen order, transaction
+# and reference lookups). Reads of a user or reference are sent to primary
+# for READ_PIN_TIMEOUT seconds after we write them (read-your-writes)
+READ_DATABASE = getattr(settings, 'OSCAR_PAYONLINE_READ_DATABASE', None)
+READ_PIN_TIMEOUT = getattr(settings, 'OSCAR_PAYONLINE_READ_PIN_TIMEOUT', 30)
+READ_PIN_CACHE_KEY = 'payonline-pin-%s'
+
+# signed redirect URLs to PayOnline per (site, order, reference, amount)
+REDIRECT_URL_CACHE_TIMEOUT = getattr(settings, 'OSCAR_PAYONLINE_REDIRECT_URL_CACHE_TIMEOUT', 60 * 60)
+REDIRECT_URL_CACHE_KEY = 'payonline-redirect-%s'
+
+# success page polls the status endpoint every STATUS_POLL_INTERVAL seconds
+# and gives up waiting for payment confirmation after STATUS_POLL_TIMEOUT seconds
+STATUS_POLL_TIMEOUT = getattr(settings, 'OSCAR_PAYONLINE_STATUS_POLL_TIMEOUT', 120)
+STATUS_POLL_INTERVAL = getattr(settings, 'OSCAR_PAYONLINE_STATUS_POLL_INTERVAL', 2)
+
+# applied offers and prices of frozen baskets are stored in cache
+# and restored by load_frozen_basket instead of applying offers again
+BASKET_SNAPSHOT = getattr(settings, 'OSCAR_PAYONLINE_BASKET_SNAPSHOT', False)
+BASKET_SNAPSHOT_TIMEOUT = getattr(settings, 'OSCAR_PAYONLINE_BASKET_SNAPSHOT_TIMEOUT', 60 * 60 * 24)
+BASKET_SNAPSHOT_CACHE_KEY = 'payonline-basket-%s'
+
+# check every callback against PayOnline API before recording payment
+API_VERIFY = getattr(settings, 'OSCAR_PAYONLINE_API_VERIFY', False)
+# statuses of PayOnline transactions which mean the customer has paid
+API_PAID_STATUSES = getattr(settings, 'OSCAR_PAYONLINE_API_PAID_STATUSES', ('Pending', 'Settled'))
+
+# bulk verification during reconciliation: concurrent API requests and requests per second
+VERIFY_WORKERS = getattr(settings, 'OSCAR_PAYONLINE_VERIFY_WORKERS', 8)
+VERIFY_RATE = getattr(settings, 'OSCAR_PAYONLINE_VERIFY_RATE', 20)
+
+# FailView fast path: failures are coalesced per order and written by
+# a background batch writer, so the gateway gets an answer without DB work
+FAIL_FAST_PATH = getattr(settings, 'OSCAR_PAYONLINE_FAIL_FAST_PATH', False)
+# notifications are coalesced per failed transaction, so the next decline
+# of the same order (customer pays again) is written
+FAIL_COALESCE_TIMEOUT = getattr(settings, 'OSCAR_PAYONLINE_FAIL_COALESCE_TIMEOUT', 60)
+FAIL_COALESCE_CACHE_KEY = 'payonline-fail-%s'
+FAIL_BATCH_SIZE = getattr(settings, 'OSCAR_PAYONLINE_FAIL_BATCH_SIZE', 100)
+# seconds to collect a batch
+FAIL_BATCH_INTERVAL = getattr(settings, 'OSCAR_PAYONLINE_FAIL_BATCH_INTERVAL', 1)
+FAIL_QUEUE_SIZE = getattr(settings, 'OSCAR_PAYONLINE_FAIL_QUEUE_SIZE', 10000)
+
+# in async mode CallbackView only saves PaymentData and queues it for
+# callback workers (see payonline_callback_worker command)
+ASYNC_CALLBACK = getattr(settings, 'OSCAR_PAYONLINE_ASYNC_CALLBACK', False)
+CALLBACK_MAX_ATTEMPTS = getattr(settings, 'OSCAR_PAYONLINE_CALLBACK_MAX_ATTEMPTS', 5)
+# seconds a worker holds a task before other workers may take it over
+CALLBACK_LEASE_TIMEOUT = getattr(settings, 'OSCAR_PAYONLINE_CALLBACK_LEASE_TIMEOUT', 60 * 5)
+
 
 class PayonlineFacade(object):
 
@@ -41,6 +123,11 @@ class PayonlineFacade(object):
         self.EVENT_CODE_FAILED = 'payonline-failed'
         self.EVENT_CODE_SUCCESSFUL = 'payonline-successful'
 
+    def get_event_codes(self):
+        return (self.EVENT_CODE_REDIRECTED,
+                self.EVENT_CODE_FAILED,
+                self.EVENT_CODE_SUCCESSFUL)
+
     def get_redirect_url(self):
         return reverse('payonline-pay')
 
@@ -50,17 +137,50 @@ class PayonlineFacade(object):
     def merchant_reference(self, basket_id):
         # Ideas stolen from Oscar's Datacash facade
 
-        # Get a random number to append to the end.  This solves the problem
+        # Append a suffix to the end.  This solves the problem
         # where a previous request crashed out and didn't save a model
         # instance.  Hence we can get a clash of merchant references.
-        merchant_id = self.get_merchant_id()
-        rand = "%04.f" % (random.random() * 10000)
-        return u'%s-%s-%s' % (merchant_id, basket_id, rand)
+        # Use TimeOrderedReferenceGenerator to make references unique
+        return get_reference_generator().generate(self.get_merchant_id(), basket_id)
+
+    def parse_merchant_reference(self, ref):
+        """
+        Returns (merchant id, order number, suffix) of the reference or None
+        """
+        return get_reference_generator().parse(ref)
+
+    def freeze_order(self, order, reference, amount):
+        """
+        Moves the order to frozen status and records 'payonline-redirected' event
+        in one transaction holding the order row lock, so concurrent attempts
+        (double click on "Pay") are serialized.
+        Returns False if order status has been changed concurrently
+        (order.status is reloaded then).
+        Raises InvalidOrderStatus if the order can't be processed
+        according to the order status pipeline.
+        """
+        event_type = registry.get_event_type(self.EVENT_CODE_REDIRECTED)
+        handler = EventHandler()
+        with transaction.atomic():
+            locked = Order.objects.select_for_update().get(pk=order.pk)
+            if locked.status != order.status:
+                order.status = locked.status
+                return False
+            handler.handle_order_status_change(locked, self.INITIAL_STATUS)
+            handler.handle_order_status_change(locked, self.FROZEN_STATUS)
+            order.status = locked.status
+            # reference is reused by repeated attempts, so record it once
+            if not PaymentEvent.objects.filter(order=order, reference=reference, event_type=event_type).exists():
+                PaymentEvent.objects.create(order=order, event_type=event_type,
+                                            amount=amount, reference=reference)
+        self.invalidate_frozen_order(order)
+        return True
 
     def defrost_basket(self, basket_id):
         basket = get_object_or_404(Basket, id=basket_id,
                                    status=Basket.FROZEN)
         basket.thaw()
+        cache.delete(BASKET_SNAPSHOT_CACHE_KEY % basket_id)
 
     def load_frozen_basket(self, request, basket_id):
         # Ideas stolen from Oscar's PayPal facade
@@ -75,19 +195,101 @@ class PayonlineFacade(object):
         if Selector:
             basket.strategy = Selector().strategy(request, request.user)
 
-        # Re-apply any offers
-        Applicator().apply(basket, request.user, request)
+        # Re-apply any offers unless they are restored from snapshot
+        if not (BASKET_SNAPSHOT and self.restore_basket_snapshot(basket)):
+            Applicator().apply(basket, request.user, request)
+            if BASKET_SNAPSHOT:
+                self.snapshot_basket(basket)
 
         return basket
 
+    def _basket_signature(self, basket):
+        # snapshot is stale if lines, vouchers or active offers have changed
+        return (
+            tuple(basket.lines.order_by('pk').values_list('pk', 'quantity', 'stockrecord_id')),
+            tuple(basket.vouchers.order_by('pk').values_list('pk', flat=True)),
+            tuple(ConditionalOffer.active.order_by('pk').values_list('pk', flat=True)),
+        )
+
+    def snapshot_basket(self, basket):
+        """
+        Stores prices and discounts of the lines and applied offers of the basket,
+        so the frozen basket can be loaded without applying offers again.
+        Call it when basket is frozen and offers are applied.
+        Only plain values are stored: lines hold the basket strategy and so the request.
+        """
+        snapshot = {
+            'signature': self._basket_signature(basket),
+            # line pk -> (unit price, discount excl. tax, discount incl. tax, discounted quantity)
+            'lines': dict((line.pk, (line.unit_effective_price, line._discount_excl_tax,
+                                     line._discount_incl_tax, line._affected_quantity))
+                          for line in basket.all_lines()),
+            'offer_applications': [
+                (application['offer'].pk,
+                 getattr(application['voucher'], 'pk', None),
+                 application['result'],
+                 application['freq'],
+                 application['discount'])
+                for application in basket.offer_applications],
+        }
+        cache.set(BASKET_SNAPSHOT_CACHE_KEY % basket.id, snapshot, BASKET_SNAPSHOT_TIMEOUT)
+
+    def restore_basket_snapshot(self, basket):
+        """
+        Restores discounts of the lines and applied offers from the snapshot
+        if it is still valid. Returns False if offers should be applied again.
+        """
+        key = BASKET_SNAPSHOT_CACHE_KEY % basket.id
+        snapshot = cache.get(key)
+        if snapshot is None:
+            return False
+        if snapshot['signature'] != self._basket_signature(basket):
+            cache.delete(key)
+            return False
+        applications = snapshot['offer_applications']
+        offers = ConditionalOffer.objects.in_bulk([offer_id for offer_id, __, __, __, __ in applications])
+        voucher_ids = [voucher_id for __, voucher_id, __, __, __ in applications if voucher_id]
+        vouchers = Voucher.objects.in_bulk(voucher_ids) if voucher_ids else {}
+        if len(offers) < len(applications) or len(vouchers) < len(voucher_ids):
+            cache.delete(key)
+            return False
+        # Basket caches its lines in _lines, so discounts set here are kept
+        lines = snapshot['lines']
+        for line in basket.all_lines():
+            if line.pk not in lines or line.unit_effective_price != lines[line.pk][0]:
+                # prices have changed since the basket was frozen
+                cache.delete(key)
+                basket._lines = None
+                return False
+            __, line._discount_excl_tax, line._discount_incl_tax, line._affected_quantity = lines[line.pk]
+        basket.offer_applications = OfferApplications()
+        for offer_id, voucher_id, result, freq, discount in applications:
+            offer = offers[offer_id]
+            voucher = vouchers.get(voucher_id)
+            offer.set_voucher(voucher)
+            basket.offer_applications.applications[offer_id] = {
+                'offer': offer,
+                'result': result,
+                'name': offer.name,
+                'description': result.description,
+                'voucher': voucher,
+                'freq': freq,
+                'discount': discount}
+        return True
+
+    @instrumented('facade.validate_order')
     def validate_order(self, ref):
-        events = PaymentEvent.objects.all().\
-            filter(reference=ref).\
-            filter(event_type__name=self.EVENT_CODE_REDIRECTED)
+        # single query: two events are enough to tell 'too many' case,
+        # backed by the index from payonline_create_indexes command
+        event_type = registry.get_event_type(self.EVENT_CODE_REDIRECTED)
+        using = self.get_read_database(self._reference_pin(ref))
+        events = list(PaymentEvent.objects.using(using).
+                      filter(reference=ref, event_type=event_type).
+                      select_related('order')[:2])
         if not events:
             msg = ("Error for reference #%s: 'payonline-redirected' event not found" % ref)
             raise PayOnlineError(msg)
-        if events.count() > 1:
+        if len(events) > 1:
             msg = ("Error for reference #%s: too many 'payonline-redirected' events found" % ref)
             raise PayOnlineError(msg)
         if not getattr(events[0], 'order'):
@@ -95,30 +297,114 @@ class PayonlineFacade(object):
             raise PayOnlineError(msg)
         return events[0].order
 
+    @instrumented('facade.load_frozen_order')
     def load_frozen_order(self, request):
         # Lookup the frozen order for user
-        #
-        orders = request.user.orders.all().filter(status=self.FROZEN_STATUS).order_by('-date_placed')
-        if orders.count() > 0:
-            # always return last placed frozen order as it must be the only one
-            return orders[0]
-        else:
+        # using cached order id (or negative marker) if any
+        key = FROZEN_ORDER_CACHE_KEY % request.user.pk
+        cached = cache.get(key)
+        if cached == NO_FROZEN_ORDER:
             return None
+        using = self.get_read_database(self._user_pin(request.user.pk))
+        if cached not in (None, FROZEN_ORDER_INVALIDATED):
+            try:
+                return request.user.orders.using(using).get(pk=cached, status=self.FROZEN_STATUS)
+            except Order.DoesNotExist:
+                # status was changed somewhere we do not track, so look it up again
+                cache.delete(key)
+        order = self._fetch_frozen_order(request.user, using)
+        if order is not None:
+            cache.set(key, order.pk, FROZEN_ORDER_CACHE_TIMEOUT)
+        else:
+            # not over the marker of a status change made during the lookup
+            cache.add(key, NO_FROZEN_ORDER, FROZEN_ORDER_CACHE_TIMEOUT)
+        return order
 
+    def _fetch_frozen_order(self, user, using=DEFAULT_DB_ALIAS):
+        # always return last placed frozen order as it must be the only one.
+        # Single query, backed by the index from payonline_create_indexes command
+        orders = user.orders.using(using).filter(status=self.FROZEN_STATUS).order_by('-date_placed')[:1]
+        for order in orders:
+            return order
+        return None
+
+    def invalidate_frozen_order(self, order):
+        """
+        Drops cached frozen order of the order's owner.
+        Must be called every time the order status is changed
+        """
+        if order is not None and order.user_id:
+            cache.set(FROZEN_ORDER_CACHE_KEY % order.user_id, FROZEN_ORDER_INVALIDATED,
+                      FROZEN_ORDER_INVALIDATED_TIMEOUT)
+            self.pin_reads(self._user_pin(order.user_id))
+
+    def _user_pin(self, user_id):
+        return 'user-%s' % user_id
+
+    def _reference_pin(self, ref):
+        return 'ref-%s' % hashlib.md5(force_bytes(ref)).hexdigest()
+
+    def pin_reads(self, *pins):
+        """
+        Sends reads for the given user or reference to primary database
+        for a while after a write, so they are not served stale data by replica
+        """
+        if READ_DATABASE:
+            cache.set_many(dict((READ_PIN_CACHE_KEY % pin, 1) for pin in pins), READ_PIN_TIMEOUT)
+
+    def get_read_database(self, *pins):
+        """
+        Returns database alias for safe reads: the replica unless
+        the read is a part of a write transaction or the data is pinned
+        to primary after a recent write
+        """
+        if not READ_DATABASE or transaction.get_connection().in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        if cache.get_many([READ_PIN_CACHE_KEY % pin for pin in pins]):
+            return DEFAULT_DB_ALIAS
+        return READ_DATABASE
+
+    def _transaction_cache_key(self, ref):
+        # reference comes from GET params on success page, so hash it to get a safe key
+        return TRANSACTION_CACHE_KEY % hashlib.md5(force_bytes(ref)).hexdigest()
+
+    @instrumented('facade.fetch_transaction_details')
     def fetch_transaction_details(self, ref):
-        txn = None
-        try:
-            txn = PaymentData.objects.get(order_id=ref)
-        except PaymentData.DoesNotExist:
+        # success page is polled until callback lands, so cache both results.
+        # Missing txn is cached for a few seconds only and never replaces
+        # the txn cached by a callback that landed during the lookup
+        key = self._transaction_cache_key(ref)
+        txn = cache.get(key)
+        if txn is None:
+            try:
+                using = self.get_read_database(self._reference_pin(ref))
+                txn = PaymentData.objects.using(using).get(order_id=ref)
+            except PaymentData.DoesNotExist:
+                cache.add(key, NO_TRANSACTION, TRANSACTION_MISSING_CACHE_TIMEOUT)
+            else:
+                cache.set(key, txn, TRANSACTION_CACHE_TIMEOUT)
+        if txn is None or txn == NO_TRANSACTION:
             msg = "Error for %s: PaymentData does not exists" % ref
             raise PayOnlineError(msg)
         return txn
 
+    def get_fail_coalesce_key(self, order_number, txn_id):
+        # both come from GET params, so hash them to get a safe key
+        key = hashlib.md5(force_bytes('%s|%s' % (order_number, txn_id))).hexdigest()
+        return FAIL_COALESCE_CACHE_KEY % key
+
+    def cache_transaction_details(self, txn):
+        """
+        Puts saved PaymentData into cache, replacing cached 'missing' marker
+        """
+        cache.set(self._transaction_cache_key(txn.order_id), txn, TRANSACTION_CACHE_TIMEOUT)
+        self.pin_reads(self._reference_pin(txn.order_id))
+
     def confirm_transaction(self, ref, amount, currency):
         """
         Confirms that transaction corrensponding to given ref-string
         exists in our database (the callback has been triggered)
-        and TODO: Payonline should return the same info.
+        and Payonline returns the same info (if OSCAR_PAYONLINE_API_VERIFY is on).
         Otherwise, two conditions can be reached:
          - we have txn recorded but no txn found via PayOnline API
            so we mark txn as suspicious
@@ -135,7 +421,95 @@ class PayonlineFacade(object):
                   "does not match requested (%s %s)" % (ref, amount, currency,
                                                         txn.amount, txn.currency ))
             raise PayOnlineError(msg)
+        if API_VERIFY and self.verify_transaction(txn) is False:
+            raise PayOnlineError("Error for %s: transaction is not confirmed by PayOnline" % ref)
         return txn
 
+    def verify_transaction(self, txn):
+        """
+        Checks saved PaymentData against PayOnline API.
+        Returns True if PayOnline has the same transaction, False if not
+        (txn is suspicious) and None if API is unavailable.
+        """
+        try:
+            remote = get_client().get_transaction(txn.order_id, txn.transaction_id)
+        except PayOnlineAPIError as e:
+            logger.warning("Can't verify transaction %s via PayOnline API: %s", txn.transaction_id, e)
+            return None
+        if remote is None:
+            logger.error("Suspicious transaction %s: not found via PayOnline API (ref: %s)",
+                         txn.transaction_id, txn.order_id)
+            return False
+        matches = self._transaction_matches(txn, remote)
+        if not matches:
+            logger.error("Suspicious transaction %s: PayOnline API returned different data %s",
+                         txn.transaction_id, remote)
+        return matches
+
+    def _transaction_matches(self, txn, remote):
+        try:
+            return (str(remote.get('Id')) == str(txn.transaction_id) and
+                    remote.get('Status') in API_PAID_STATUSES and
+                    D(remote.get('Amount')) == D(str(txn.amount)) and
+                    remote.get('Currency') == txn.currency)
+        except InvalidOperation:
+            return False
+
+    def verify_transactions(self, refs, workers=VERIFY_WORKERS, rate=VERIFY_RATE):
+        """
+        Checks many merchant references against PayOnline API concurrently
+        (bounded pool, rate limited) and compares results with PaymentData
+        in one pass. Returns a dict of lists:
+         - confirmed: refs with matching local and PayOnline txns
+         - suspicious: refs with local txn not found or different at PayOnline
+         - missing: refs with paid txn at PayOnline but no local record
+         - unavailable: refs PayOnline API failed to answer for
+        Declined attempts without local records are not reported.
+        """
+        refs = list(set(refs))
+        client = get_client()
+        limiter = RateLimiter(rate) if rate else None
+
+        def search(ref):
+            if limiter is not None:
+                limiter.acquire()
+            try:
+                return client.search(ref)
+            except PayOnlineAPIError as e:
+                logger.warning("Can't verify reference %s via PayOnline API: %s", ref, e)
+                return e
+
+        if ThreadPoolExecutor is not None and workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                remotes = dict(zip(refs, executor.map(search, refs)))
+        else:
+            remotes = dict((ref, search(ref)) for ref in refs)
+
+        local = dict((txn.order_id, txn) for txn in PaymentData.objects.filter(order_id__in=refs))
+        result = {'confirmed': [], 'suspicious': [], 'missing': [], 'unavailable': []}
+        for ref in refs:
+            transactions, txn = remotes[ref], local.get(ref)
+            if isinstance(transactions, PayOnlineAPIError):
+                result['unavailable'].append(ref)
+            elif txn is None:
+                paid = [remote for remote in transactions if remote.get('Status') in API_PAID_STATUSES]
+                if paid:
+                    logger.error("PayOnline txn %s has no local record (ref: %s)", paid[0].get('Id'), ref)
+                    result['missing'].append(ref)
+                # otherwise customer did not pay
+            else:
+                remote = None
+                for candidate in transactions:
+                    if candidate.get('Id') == str(txn.transaction_id):
+                        remote = candidate
+                        break
+                if remote is None or not self._transaction_matches(txn, remote):
+                    logger.error("Suspicious transaction %s (ref: %s), PayOnline API returned %s",
+                                 txn.transaction_id, ref, remote)
+                    result['suspicious'].append(ref)
+                else:
+                    result['confirmed'].append(ref)
+        return result
+
     def get_error_message(self, code):
-        return APIErrors().get(code)
+        return error_catalogue.get(code)
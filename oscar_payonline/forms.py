@@ -0,0 +1,12 @@
+from payonline.forms import PaymentDataForm
+
+
+class CallbackPaymentDataForm(PaymentDataForm):
+    """
+    PaymentDataForm without unique checks on validation.
+    Checking uniqueness with a separate query is racy, so duplicates are
+    caught by database constraints on save instead.
+    """
+
+    def validate_unique(self):
+        pass
@@ -0,0 +1,144 @@
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+
+from .signals import stage_timed
+
+# Stage timings are off by default. When disabled, timed() returns a shared
+# no-op context manager and instrumented() leaves functions untouched
+INSTRUMENTATION_ENABLED = getattr(settings, 'OSCAR_PAYONLINE_INSTRUMENTATION', False)
+HISTOGRAM_BUCKETS = getattr(settings, 'OSCAR_PAYONLINE_HISTOGRAM_BUCKETS',
+                            (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+
+
+class Metrics(object):
+    """
+    In-process latency histograms and error counters per stage
+    """
+
+    def __init__(self, buckets=HISTOGRAM_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            # stage -> [bucket counts..., +Inf count, sum, errors]
+            self._stages = {}
+
+    def observe(self, stage, duration, success=True):
+        size = len(self.buckets)
+        with self._lock:
+            data = self._stages.get(stage)
+            if data is None:
+                data = self._stages[stage] = [0] * (size + 1) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if duration <= bound:
+                    data[i] += 1
+            data[size] += 1
+            data[size + 1] += duration
+            if not success:
+                data[size + 2] += 1
+
+    def snapshot(self):
+        """
+        Returns {stage: {'buckets': [(le, count), ...], 'count': n, 'sum': s, 'errors': e}}
+        """
+        size = len(self.buckets)
+        with self._lock:
+            stages = dict((stage, list(data)) for stage, data in self._stages.items())
+        result = {}
+        for stage, data in stages.items():
+            result[stage] = {
+                'buckets': list(zip(self.buckets, data[:size])),
+                'count': data[size],
+                'sum': data[size + 1],
+                'errors': data[size + 2],
+            }
+        return result
+
+    def render_prometheus(self):
+        """
+        Renders metrics in Prometheus text exposition format
+        """
+        lines = ['# TYPE payonline_stage_duration_seconds histogram']
+        snapshot = sorted(self.snapshot().items())
+        for stage, data in snapshot:
+            for bound, count in data['buckets']:
+                lines.append('payonline_stage_duration_seconds_bucket{stage="%s",le="%s"} %d' % (
+                    stage, bound, count))
+            lines.append('payonline_stage_duration_seconds_bucket{stage="%s",le="+Inf"} %d' % (
+                stage, data['count']))
+            lines.append('payonline_stage_duration_seconds_sum{stage="%s"} %f' % (stage, data['sum']))
+            lines.append('payonline_stage_duration_seconds_count{stage="%s"} %d' % (stage, data['count']))
+        lines.append('# TYPE payonline_stage_errors_total counter')
+        for stage, data in snapshot:
+            lines.append('payonline_stage_errors_total{stage="%s"} %d' % (stage, data['errors']))
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+def record(stage, duration, success=True):
+    metrics.observe(stage, duration, success)
+    stage_timed.send(sender=Metrics, stage=stage, duration=duration, success=success)
+
+
+class Timer(object):
+    __slots__ = ('stage', 'start')
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        record(self.stage, time.time() - self.start, exc_type is None)
+        return False
+
+
+class NullTimer(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NULL_TIMER = NullTimer()
+
+
+def timed(stage):
+    """
+    Context manager recording duration of the stage
+    """
+    if not INSTRUMENTATION_ENABLED:
+        return NULL_TIMER
+    return Timer(stage)
+
+
+def instrumented(stage):
+    """
+    Decorator recording duration of every call of the function as the stage
+    """
+    def decorator(func):
+        if not INSTRUMENTATION_ENABLED:
+            return func
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with Timer(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def get_backend_name(backend):
+    return '%s.%s' % (getattr(backend, '__module__', ''),
+                      getattr(backend, '__name__', backend.__class__.__name__))
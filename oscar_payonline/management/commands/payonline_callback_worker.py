@@ -0,0 +1,72 @@
+import logging
+import threading
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from payonline.models import PaymentData
+
+from oscar_payonline.facade import CALLBACK_MAX_ATTEMPTS, CALLBACK_LEASE_TIMEOUT
+from oscar_payonline.models import CallbackTask
+from oscar_payonline.processing import CallbackProcessor
+
+logger = logging.getLogger('payonline')
+
+
+class Command(BaseCommand):
+    help = "Processes PayOnline callbacks queued in async mode (OSCAR_PAYONLINE_ASYNC_CALLBACK)"
+
+    option_list = BaseCommand.option_list + (
+        make_option('--workers', action='store', dest='workers', type='int', default=1,
+                    help='Number of worker threads.'),
+        make_option('--sleep', action='store', dest='sleep', type='float', default=1.0,
+                    help='Seconds to wait when the queue is empty.'),
+        make_option('--drain', action='store_true', dest='drain', default=False,
+                    help='Exit when the queue is empty instead of waiting for new tasks.'),
+    )
+
+    def handle(self, *args, **options):
+        self.stopped = threading.Event()
+        workers = []
+        for i in range(max(options['workers'], 1)):
+            worker = threading.Thread(target=self.run_worker,
+                                      args=(options['sleep'], options['drain']),
+                                      name='payonline-worker-%s' % i)
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+        try:
+            while any(worker.is_alive() for worker in workers):
+                time.sleep(0.5)
+        except KeyboardInterrupt:
+            self.stopped.set()
+            for worker in workers:
+                worker.join()
+
+    def run_worker(self, sleep, drain):
+        try:
+            while not self.stopped.is_set():
+                task = CallbackTask.objects.claim(CALLBACK_LEASE_TIMEOUT)
+                if task is None:
+                    if drain:
+                        break
+                    self.stopped.wait(sleep)
+                    continue
+                self.process_task(task)
+        finally:
+            # every thread has its own connection
+            connection.close()
+
+    def process_task(self, task):
+        try:
+            payment_data = PaymentData.objects.get(transaction_id=task.transaction_id)
+            CallbackProcessor().process(payment_data)
+        except Exception as e:
+            logger.exception("Callback processing failed (txn_id:%s, attempt:%s)",
+                             task.transaction_id, task.attempts)
+            task.mark_failed(str(e), CALLBACK_MAX_ATTEMPTS)
+        else:
+            logger.info("Callback processed (txn_id:%s)", task.transaction_id)
+            task.mark_done()
@@ -0,0 +1,72 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.db import connections, DEFAULT_DB_ALIAS
+
+from oscar.core.loading import get_model
+
+Order = get_model('order', 'Order')
+PaymentEvent = get_model('order', 'PaymentEvent')
+
+
+# Oscar's tables are not ours, so we can't ship migrations for them.
+# Every index is (model, index name, column definitions)
+INDEXES = (
+    # frozen order lookup in PayonlineFacade.load_frozen_order
+    (Order, 'payonline_order_user_status_placed',
+     ('user_id', 'status', 'date_placed DESC')),
+    # merchant reference lookup in PayonlineFacade.validate_order
+    (PaymentEvent, 'payonline_paymentevent_ref_type',
+     ('reference', 'event_type_id')),
+)
+
+
+class Command(BaseCommand):
+    help = "Creates database indexes used by oscar_payonline lookups on Oscar's tables"
+
+    option_list = BaseCommand.option_list + (
+        make_option('--database', action='store', dest='database', default=DEFAULT_DB_ALIAS,
+                    help='Database to create indexes in. Defaults to the "default" database.'),
+        make_option('--dry-run', action='store_true', dest='dry_run', default=False,
+                    help='Print SQL statements without executing them.'),
+    )
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        qn = connection.ops.quote_name
+        # plain CREATE INDEX blocks writes to the table while the index is built,
+        # postgres can build it concurrently, but not inside a transaction
+        concurrently = connection.vendor == 'postgresql' and not connection.in_atomic_block
+        with connection.cursor() as cursor:
+            for model, name, columns in INDEXES:
+                table = model._meta.db_table
+                existing = connection.introspection.get_constraints(cursor, table)
+                if name in existing:
+                    if not (concurrently and self.is_invalid(cursor, name)):
+                        self.stdout.write("Index %s on %s already exists" % (name, table))
+                        continue
+                    # left by interrupted concurrent build
+                    self.stdout.write("Index %s on %s is invalid, rebuilding" % (name, table))
+                    drop_sql = 'DROP INDEX CONCURRENTLY %s' % qn(name)
+                    if options['dry_run']:
+                        self.stdout.write(drop_sql)
+                    else:
+                        cursor.execute(drop_sql)
+                cols = []
+                for column in columns:
+                    parts = column.split(' ', 1)
+                    parts[0] = qn(parts[0])
+                    cols.append(' '.join(parts))
+                sql = 'CREATE INDEX %s%s ON %s (%s)' % ('CONCURRENTLY ' if concurrently else '',
+                                                       qn(name), qn(table), ', '.join(cols))
+                if options['dry_run']:
+                    self.stdout.write(sql)
+                    continue
+                cursor.execute(sql)
+                self.stdout.write("Index %s on %s created" % (name, table))
+
+    def is_invalid(self, cursor, name):
+        cursor.execute('SELECT NOT indisvalid FROM pg_index '
+                       'JOIN pg_class ON pg_class.oid = pg_index.indexrelid WHERE relname = %s', [name])
+        row = cursor.fetchone()
+        return bool(row and row[0])
@@ -0,0 +1,35 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from oscar_payonline.export import iter_transactions, parse_date, WRITERS
+
+
+class Command(BaseCommand):
+    help = ("Exports PayOnline transactions joined to orders, payment sources and events "
+            "as CSV or JSON to stdout")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--format', action='store', dest='format', default='csv',
+                    help='csv or json.'),
+        make_option('--from', action='store', dest='date_from', default=None,
+                    help='First day to export, YYYY-MM-DD.'),
+        make_option('--to', action='store', dest='date_to', default=None,
+                    help='Last day to export, YYYY-MM-DD.'),
+        make_option('--status', action='store', dest='status', default=None,
+                    help='Export only transactions of orders with this status.'),
+        make_option('--chunk-size', action='store', dest='chunk_size', type='int', default=1000),
+    )
+
+    def handle(self, *args, **options):
+        if options['format'] not in WRITERS:
+            raise CommandError("Unknown format: %s" % options['format'])
+        try:
+            date_from = parse_date(options['date_from'])
+            date_to = parse_date(options['date_to'])
+        except ValueError as e:
+            raise CommandError(e)
+        writer, __ = WRITERS[options['format']]
+        rows = iter_transactions(date_from, date_to, options['status'], options['chunk_size'])
+        for line in writer(rows):
+            self.stdout.write(line, ending='')
@@ -0,0 +1,125 @@
+import logging
+from datetime import timedelta
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from django.utils.translation import ugettext as _
+
+from oscar.core.loading import get_model
+
+from payonline.models import PaymentData
+
+from oscar_payonline.facade import PayonlineFacade
+from oscar_payonline.processing import CallbackProcessor
+from oscar_payonline.registry import registry
+
+Order = get_model('order', 'Order')
+PaymentEvent = get_model('order', 'PaymentEvent')
+
+logger = logging.getLogger('payonline')
+
+PAID, FAILED, EXPIRED, PENDING = 'paid', 'failed', 'expired', 'pending'
+
+
+class Command(BaseCommand):
+    help = ("Reconciles orders frozen for PayOnline payment: completes paid ones "
+            "and moves failed and expired ones to failed status")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--chunk-size', action='store', dest='chunk_size', type='int', default=500,
+                    help='Number of orders processed per transaction.'),
+        make_option('--expire-after', action='store', dest='expire_after', type='int', default=24,
+                    help='Hours since redirection to PayOnline after which unpaid order is expired.'),
+        make_option('--dry-run', action='store_true', dest='dry_run', default=False,
+                    help='Classify orders without changing them.'),
+    )
+
+    def handle(self, *args, **options):
+        self.facade = PayonlineFacade()
+        self.dry_run = options['dry_run']
+        expire_before = timezone.now() - timedelta(hours=options['expire_after'])
+        event_types = dict((code, registry.get_event_type(code).pk)
+                           for code in self.facade.get_event_codes())
+        totals = dict((verdict, 0) for verdict in (PAID, FAILED, EXPIRED, PENDING))
+
+        # keyset pagination keeps memory flat and is not affected by orders
+        # leaving frozen status while we go
+        last_pk = 0
+        while True:
+            orders = list(Order.objects.filter(status=self.facade.FROZEN_STATUS,
+                                               pk__gt=last_pk).order_by('pk')[:options['chunk_size']])
+            if not orders:
+                break
+            last_pk = orders[-1].pk
+            classified = list(self.classify(orders, event_types, expire_before))
+            for order, verdict, payment_data in classified:
+                totals[verdict] += 1
+            if self.dry_run:
+                continue
+            # paid orders are verified via API before the transaction is opened,
+            # not to hold locks during the requests
+            verified = dict((order.pk, CallbackProcessor().verify(payment_data))
+                            for order, verdict, payment_data in classified if verdict == PAID)
+            with transaction.atomic():
+                for order, verdict, payment_data in classified:
+                    try:
+                        # every order in its own savepoint, so one failed order
+                        # does not roll back the rest of the chunk
+                        with transaction.atomic():
+                            self.apply(order, verdict, payment_data, verified.get(order.pk))
+                    except Exception:
+                        logger.exception("Can't reconcile order #%s", order.number)
+
+        self.stdout.write(', '.join('%s: %s' % item for item in sorted(totals.items())))
+
+    def classify(self, orders, event_types, expire_before):
+        """
+        Yields (order, verdict, payment data) for the chunk of frozen orders
+        using two queries for the whole chunk
+        """
+        redirected = event_types[self.facade.EVENT_CODE_REDIRECTED]
+        failed = event_types[self.facade.EVENT_CODE_FAILED]
+        refs, last_events = {}, {}
+        events = PaymentEvent.objects.filter(
+            order_id__in=[order.pk for order in orders],
+            event_type_id__in=event_types.values()).order_by('date_created').values_list(
+            'order_id', 'event_type_id', 'reference', 'date_created')
+        for order_id, event_type_id, reference, date_created in events:
+            if event_type_id == redirected:
+                refs.setdefault(order_id, []).append(reference)
+            last_events[order_id] = (event_type_id, date_created)
+        payments = dict((txn.order_id, txn) for txn in PaymentData.objects.filter(
+            order_id__in=[ref for order_refs in refs.values() for ref in order_refs]))
+
+        for order in orders:
+            payment_data = None
+            for ref in refs.get(order.pk, ()):
+                payment_data = payments.get(ref, payment_data)
+            event_type_id, date_created = last_events.get(order.pk, (None, order.date_placed))
+            if payment_data is not None:
+                verdict = PAID
+            elif event_type_id == failed:
+                verdict = FAILED
+            elif date_created < expire_before:
+                verdict = EXPIRED
+            else:
+                verdict = PENDING
+            yield order, verdict, payment_data
+
+    def apply(self, order, verdict, payment_data, verified=None):
+        processor = CallbackProcessor()
+        if verdict == PAID:
+            # callback was received but not completed
+            logger.warning("Reconciling paid frozen order #%s (txn_id:%s)",
+                           order.number, payment_data.transaction_id)
+            processor.record_payment(payment_data, verified)
+        elif verdict == FAILED:
+            processor.set_order_status(order, self.facade.FAILED_STATUS,
+                                       _("Payment for order #%s failed. Status changed by reconciliation")
+                                       % order.number)
+        elif verdict == EXPIRED:
+            processor.set_order_status(order, self.facade.FAILED_STATUS,
+                                       _("Payment for order #%s expired. No payment information received "
+                                         "from Payonline") % order.number)
@@ -0,0 +1,38 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from payonline.models import PaymentData
+from payonline.settings import CONFIG as PAYONLINE_CONFIG
+
+from oscar_payonline.stub import StubPayonlineServer
+
+
+def lookup_payment_data(ref):
+    # the stub knows every transaction saved locally
+    return [{'Id': txn.transaction_id,
+             'OrderId': txn.order_id,
+             'Amount': txn.amount,
+             'Currency': txn.currency,
+             'Status': 'Settled'} for txn in PaymentData.objects.filter(order_id=ref)]
+
+
+class Command(BaseCommand):
+    help = ("Runs local stub of PayOnline search API answering with locally saved PaymentData. "
+            "Point OSCAR_PAYONLINE_API_SEARCH_URL to it for development and benchmarks")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--host', action='store', dest='host', default='127.0.0.1'),
+        make_option('--port', action='store', dest='port', type='int', default=8765),
+    )
+
+    def handle(self, *args, **options):
+        server = StubPayonlineServer(PAYONLINE_CONFIG['MERCHANT_ID'],
+                                     PAYONLINE_CONFIG['PRIVATE_SECURITY_KEY'],
+                                     host=options['host'], port=options['port'],
+                                     lookup=lookup_payment_data)
+        self.stdout.write("Serving PayOnline stub at %s" % server.url)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
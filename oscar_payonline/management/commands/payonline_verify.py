@@ -0,0 +1,54 @@
+from datetime import timedelta
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from oscar.core.loading import get_model
+
+from oscar_payonline.facade import PayonlineFacade, VERIFY_WORKERS, VERIFY_RATE
+from oscar_payonline.registry import registry
+
+PaymentEvent = get_model('order', 'PaymentEvent')
+
+
+class Command(BaseCommand):
+    help = ("Verifies PayOnline transactions of recent redirections against PayOnline API. "
+            "Reports suspicious transactions and transactions missing locally")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--days', action='store', dest='days', type='int', default=1,
+                    help='Verify redirections of that many last days.'),
+        make_option('--chunk-size', action='store', dest='chunk_size', type='int', default=1000,
+                    help='Number of references verified at once.'),
+        make_option('--workers', action='store', dest='workers', type='int', default=VERIFY_WORKERS,
+                    help='Concurrent PayOnline API requests.'),
+        make_option('--rate', action='store', dest='rate', type='float', default=VERIFY_RATE,
+                    help='PayOnline API requests per second.'),
+    )
+
+    def handle(self, *args, **options):
+        facade = PayonlineFacade()
+        since = timezone.now() - timedelta(days=options['days'])
+        events = PaymentEvent.objects.filter(
+            event_type=registry.get_event_type(facade.EVENT_CODE_REDIRECTED),
+            date_created__gte=since)
+        totals = {'confirmed': 0, 'suspicious': [], 'missing': [], 'unavailable': []}
+
+        last_pk = 0
+        while True:
+            chunk = list(events.filter(pk__gt=last_pk).order_by('pk').values_list(
+                'pk', 'reference')[:options['chunk_size']])
+            if not chunk:
+                break
+            last_pk = chunk[-1][0]
+            result = facade.verify_transactions([ref for __, ref in chunk],
+                                                workers=options['workers'], rate=options['rate'])
+            totals['confirmed'] += len(result['confirmed'])
+            for key in ('suspicious', 'missing', 'unavailable'):
+                totals[key].extend(result[key])
+
+        self.stdout.write("Confirmed: %s" % totals['confirmed'])
+        for key in ('suspicious', 'missing', 'unavailable'):
+            self.stdout.write("%s: %s %s" % (key.capitalize(), len(totals[key]),
+                                             ' '.join(totals[key])))
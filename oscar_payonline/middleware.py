@@ -1,39 +1,53 @@
+from functools import partial
+
 from django.conf import settings
-from django.contrib import messages
-from django.utils.functional import SimpleLazyObject, empty
-from django.utils.translation import ugettext_lazy as _
+from django.utils.functional import SimpleLazyObject
 
-from oscar.core.loading import get_class, get_model
+from oscar.core.loading import get_model
 
 from .facade import PayonlineFacade
 
 Order = get_model('order', 'Order')
 
+# requests to these path prefixes never show a frozen order (static files, API etc.),
+# so the middleware does nothing for them
+EXCLUDED_PATHS = tuple(getattr(settings, 'OSCAR_PAYONLINE_MIDDLEWARE_EXCLUDED_PATHS',
+                               [path for path in (getattr(settings, 'STATIC_URL', None),
+                                                  getattr(settings, 'MEDIA_URL', None),
+                                                  '/api/') if path]))
+# staff users usually do not pay for orders in the shop
+EXCLUDE_STAFF = getattr(settings, 'OSCAR_PAYONLINE_MIDDLEWARE_EXCLUDE_STAFF', False)
+
 
 class FrozenOrderMiddleware(object):
 
+    def __init__(self):
+        self.facade = PayonlineFacade()
+        self._payment_url = None
+
     # Middleware interface methods
 
     def process_request(self, request):
+        if request.path.startswith(EXCLUDED_PATHS):
+            request.frozen_order = None
+            request.frozen_order_pay_url = None
+            return
 
         # We lazily load the frozen order so use a private variable to hold the
         # cached instance.
         request._order_cache = None
 
-        def load_frozen_order():
-            order = self.get_frozen_order(request)
-            return order
-
-        def get_payment_url():
-            facade = PayonlineFacade()
-            return facade.get_redirect_url()
-
         # Use Django's SimpleLazyObject to only perform the loading work
         # when the attribute is accessed.
-        request.frozen_order = SimpleLazyObject(load_frozen_order)
-        request.frozen_order_pay_url = SimpleLazyObject(get_payment_url)
+        request.frozen_order = SimpleLazyObject(partial(self.get_frozen_order, request))
+        request.frozen_order_pay_url = self.get_payment_url()
 
     def process_template_response(self, request, response):
+        if getattr(request, 'frozen_order', None) is None:
+            # excluded request
+            return response
+        if 'html' not in response.get('Content-Type', ''):
+            return response
         if hasattr(response, 'context_data'):
             if response.context_data is None:
                 response.context_data = {}
@@ -52,10 +66,20 @@ class FrozenOrderMiddleware(object):
                 response.context_data['previous_frozen_order'] = request.frozen_order
         return response
 
+    def get_payment_url(self):
+        # url never changes, so resolve it once
+        if self._payment_url is None:
+            self._payment_url = self.facade.get_redirect_url()
+        return self._payment_url
+
     def get_frozen_order(self, request):
         if request._order_cache is not None:
             return request._order_cache
-        facade = PayonlineFacade()
-        order = facade.load_frozen_order(request)
+        user = request.user
+        # anonymous users have no orders to pay,
+        # users without frozen orders cost a cache lookup only (see load_frozen_order)
+        if not user.is_authenticated() or (EXCLUDE_STAFF and user.is_staff):
+            return None
+        order = self.facade.load_frozen_order(request)
         request._order_cache = order
         return order
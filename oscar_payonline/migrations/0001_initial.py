@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CallbackTask',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('transaction_id', models.CharField(unique=True, max_length=64, verbose_name='Transaction ID')),
+                ('status', models.CharField(default='pending', max_length=16, verbose_name='Status', db_index=True, choices=[('pending', 'Pending'), ('processing', 'Processing'), ('done', 'Done'), ('failed', 'Failed')])),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='Attempts')),
+                ('locked_until', models.DateTimeField(null=True, verbose_name='Locked until', blank=True)),
+                ('last_error', models.TextField(verbose_name='Last error', blank=True)),
+                ('date_created', models.DateTimeField(auto_now_add=True, verbose_name='Date created')),
+                ('date_updated', models.DateTimeField(auto_now=True, verbose_name='Date updated')),
+            ],
+            options={
+                'ordering': ('pk',),
+                'verbose_name': 'PayOnline callback task',
+                'verbose_name_plural': 'PayOnline callback tasks',
+            },
+            bases=(models.Model,),
+        ),
+    ]
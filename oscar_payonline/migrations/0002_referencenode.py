@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('oscar_payonline', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReferenceNode',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('date_created', models.DateTimeField(auto_now_add=True, verbose_name='Date created')),
+            ],
+            options={
+                'verbose_name': 'Merchant reference node',
+                'verbose_name_plural': 'Merchant reference nodes',
+            },
+            bases=(models.Model,),
+        ),
+    ]
@@ -1 +1,90 @@
 # -*- coding: utf-8 -*-
+from datetime import timedelta
+
+from django.db import models
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.translation import ugettext_lazy as _
+
+
+class CallbackTaskManager(models.Manager):
+
+    def claim(self, lease_timeout, candidates=10):
+        """
+        Takes the next task available for processing and leases it
+        for lease_timeout seconds. Expired leases (crashed workers) are taken over,
+        so every task is processed at least once.
+        Returns None if nothing to do.
+        """
+        now = timezone.now()
+        available = self.get_queryset().filter(
+            Q(status=self.model.PENDING) |
+            Q(status=self.model.PROCESSING, locked_until__lt=now)).order_by('pk')
+        for task in available[:candidates]:
+            # conditional update works as optimistic lock, so concurrent workers
+            # never take the same task
+            claimed = self.get_queryset().filter(
+                pk=task.pk, status=task.status, locked_until=task.locked_until).update(
+                status=self.model.PROCESSING,
+                locked_until=now + timedelta(seconds=lease_timeout),
+                attempts=F('attempts') + 1)
+            if claimed:
+                return self.get_queryset().get(pk=task.pk)
+        return None
+
+
+class CallbackTask(models.Model):
+    """
+    Saved PayOnline callback waiting for processing by callback workers
+    """
+    PENDING, PROCESSING, DONE, FAILED = 'pending', 'processing', 'done', 'failed'
+    STATUS_CHOICES = (
+        (PENDING, _('Pending')),
+        (PROCESSING, _('Processing')),
+        (DONE, _('Done')),
+        (FAILED, _('Failed')),
+    )
+
+    transaction_id = models.CharField(_('Transaction ID'), max_length=64, unique=True)
+    status = models.CharField(_('Status'), max_length=16, choices=STATUS_CHOICES,
+                              default=PENDING, db_index=True)
+    attempts = models.PositiveIntegerField(_('Attempts'), default=0)
+    locked_until = models.DateTimeField(_('Locked until'), null=True, blank=True)
+    last_error = models.TextField(_('Last error'), blank=True)
+    date_created = models.DateTimeField(_('Date created'), auto_now_add=True)
+    date_updated = models.DateTimeField(_('Date updated'), auto_now=True)
+
+    objects = CallbackTaskManager()
+
+    class Meta:
+        ordering = ('pk',)
+        verbose_name = _('PayOnline callback task')
+        verbose_name_plural = _('PayOnline callback tasks')
+
+    def __unicode__(self):
+        return u'%s (%s)' % (self.transaction_id, self.status)
+
+    def mark_done(self):
+        self.status = self.DONE
+        self.locked_until = None
+        self.last_error = ''
+        self.save()
+
+    def mark_failed(self, error, max_attempts):
+        # give it another try until attempts exhausted
+        self.status = self.FAILED if self.attempts >= max_attempts else self.PENDING
+        self.locked_until = None
+        self.last_error = error
+        self.save()
+
+
+class ReferenceNode(models.Model):
+    """
+    Every process generating time-ordered merchant references
+    takes the next id of this table as its node id
+    """
+    date_created = models.DateTimeField(_('Date created'), auto_now_add=True)
+
+    class Meta:
+        verbose_name = _('Merchant reference node')
+        verbose_name_plural = _('Merchant reference nodes')
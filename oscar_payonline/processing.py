@@ -0,0 +1,290 @@
+import logging
+import threading
+import time
+
+try:
+    from Queue import Queue, Empty, Full
+except ImportError:
+    from queue import Queue, Empty, Full
+
+from django.core.cache import cache
+from django.db import transaction, close_old_connections
+from django.utils.translation import ugettext as _
+
+from oscar.core.loading import get_class, get_classes, get_model
+
+from payonline.loader import get_success_backends
+
+from .facade import (PayonlineFacade, API_VERIFY,
+                     FAIL_BATCH_SIZE, FAIL_BATCH_INTERVAL, FAIL_QUEUE_SIZE)
+from .registry import registry
+
+from .exceptions import PayOnlineError
+from .backends import BackendRunner
+from .instrumentation import timed
+
+InvalidOrderStatus, InvalidPaymentEvent = get_classes('order.exceptions', ('InvalidOrderStatus',
+                                                                           'InvalidPaymentEvent'))
+EventHandler = get_class('order.processing', 'EventHandler')
+
+Order = get_model('order', 'Order')
+Source = get_model('payment', 'Source')
+PaymentEvent = get_model('order', 'PaymentEvent')
+PaymentEventQuantity = get_model('order', 'PaymentEventQuantity')
+
+
+logger = logging.getLogger('payonline')
+
+
+# the mixin below composed from methods of oscar.apps.checkout.mixins.OrderPlacementMixin
+class PaymentHandleMixin(object):
+
+    def add_payment_source(self, source):
+        """
+        Record a payment source for this order
+        """
+        if self._payment_sources is None:
+            self._payment_sources = []
+        self._payment_sources.append(source)
+
+    def add_payment_event(self, event_type_name, amount, reference=''):
+        """
+        Record a payment event
+        """
+        event_type = registry.get_event_type(event_type_name)
+        # We keep a local cache of (unsaved) payment events
+        if self._payment_events is None:
+            self._payment_events = []
+
+        event = PaymentEvent(
+            event_type=event_type, amount=amount,
+            reference=reference)
+        if event:
+            self._payment_events.append(event)
+
+    def save_payment_details(self, order):
+        """
+        Saves all payment-related details. This could include a billing
+        address, payment sources and any order payment events.
+        """
+        self.save_payment_events(order)
+        self.save_payment_sources(order)
+
+    def save_payment_events(self, order):
+        """
+        Saves any relevant payment events for this order
+        """
+        if not self._payment_events:
+            return
+        with transaction.atomic():
+            # events need their pk for quantities and bulk_create doesn't
+            # set it on every backend, so save them one by one (usually one)
+            for event in self._payment_events:
+                event.order = order
+                event.save()
+            # We assume all lines are involved in the initial payment event
+            PaymentEventQuantity.objects.bulk_create([
+                PaymentEventQuantity(event=event, line=line, quantity=line.quantity)
+                for line in order.lines.all()])
+
+    def save_payment_sources(self, order):
+        """
+        Saves any payment sources used in this order.
+
+        When the payment sources are created, the order model does not exist
+        and so they need to have it set before saving.
+        """
+        if not self._payment_sources:
+            return
+        for source in self._payment_sources:
+            source.order = order
+            source.save()
+
+    def set_order_status(self, order, new_status, note_msg=None):
+        old_status = order.status
+        try:
+            with timed('status_change'):
+                EventHandler().handle_order_status_change(order, new_status, note_msg)
+        except InvalidOrderStatus:
+            logger.error("Can't change order status to: %s. Previous status: %s", new_status, old_status)
+        PayonlineFacade().invalidate_frozen_order(order)
+        if order.status == new_status:
+            logger.warning("Order #%s status changed to %s", order.number, new_status)
+
+
+class CallbackProcessor(PaymentHandleMixin):
+    """
+    Completes the order for saved PaymentData: records payment source and event,
+    changes order status and calls success backends.
+    Used by CallbackView directly or by callback workers in async mode.
+    """
+
+    def __init__(self):
+        self._payment_events = None
+        self._payment_sources = None
+        self.facade = PayonlineFacade()
+
+    def is_processed(self, order, ref):
+        # callbacks are processed at least once, so record payment only once
+        return order.payment_events.filter(
+            reference=ref,
+            event_type=registry.get_event_type(self.facade.EVENT_CODE_SUCCESSFUL)).exists()
+
+    def process(self, payment_data):
+        order = self.record_payment(payment_data)
+        self.run_backends(payment_data)
+        return order
+
+    def verify(self, payment_data):
+        """
+        Checks the transaction via PayOnline API if OSCAR_PAYONLINE_API_VERIFY is on.
+        Returns False for suspicious transactions only, so payments are
+        still recorded when the API is unavailable.
+        Call it outside of transactions, not to hold locks during the API request.
+        """
+        return not (API_VERIFY and self.facade.verify_transaction(payment_data) is False)
+
+    def record_payment(self, payment_data, verified=None):
+        """
+        Records payment and changes order status in a single transaction
+        holding the order row lock, so concurrent callbacks for the same order
+        are serialized. Pass the result of verify() as verified,
+        otherwise the transaction is verified here.
+        """
+        order = None
+        facade = self.facade
+        txn_id = payment_data.transaction_id
+        ref = payment_data.order_id  # meaning payonline's order id which is merchant reference
+        amount = payment_data.amount
+        currency = payment_data.currency
+
+        if verified is None:
+            verified = self.verify(payment_data)
+        if not verified:
+            # leave the order frozen for manual check
+            logger.error("Payment not recorded for unconfirmed transaction %s (ref: %s)", txn_id, ref)
+            return None
+
+        # Record payment source and event
+        source_type = registry.get_source_type()
+        source = Source(source_type=source_type,
+                        currency=currency,
+                        amount_allocated=amount,
+                        amount_debited=amount,
+                        reference=ref)
+        self.add_payment_source(source)
+        self.add_payment_event(facade.EVENT_CODE_SUCCESSFUL, amount,
+                               reference=ref)
+
+        with transaction.atomic():
+            # move order to Payment successful status
+            try:
+                with timed('callback.validate'):
+                    order = facade.validate_order(ref)
+                    if order:
+                        order = Order.objects.select_for_update().get(pk=order.pk)
+            except PayOnlineError as e:
+                logger.error(
+                    "Payment event not saved. Can't find order for reference %s: Reason: %s", ref, e)
+            if order and self.is_processed(order, ref):
+                logger.warning("Payment already recorded for order #%s (txn_id:%s, ref:%s)",
+                               order.number, txn_id, ref)
+            elif order:
+                logger.info(
+                    "Payment event saved for order #%s (type:%s, amount:%s, ref: %s)",
+                    order.number, source_type, amount, ref)
+                with timed('callback.save_events'):
+                    self.save_payment_details(order)
+                note_msg = _("Successful payment information received from Payonline."
+                             "Transaction ID: %s. Order status changed" % txn_id)
+                self.set_order_status(order, facade.SUCCESSFUL_STATUS, note_msg)
+        return order
+
+    def run_backends(self, payment_data):
+        # for backward compatibility
+        backends = get_success_backends()
+        BackendRunner('success').run(backends, payment_data)
+
+
+class FailedPaymentWriter(PaymentHandleMixin):
+    """
+    Moves orders to failed payment status in batches from a background thread.
+    Failures queued when the process dies are left frozen and picked up
+    by payonline_reconcile command.
+    """
+
+    def __init__(self, batch_size=FAIL_BATCH_SIZE, interval=FAIL_BATCH_INTERVAL, max_size=FAIL_QUEUE_SIZE):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.queue = Queue(maxsize=max_size)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def put(self, order_number, txn_id, note_msg):
+        self.start()
+        try:
+            self.queue.put_nowait((order_number, txn_id, note_msg))
+        except Full:
+            logger.warning("Failed payments queue is full. Writing order #%s synchronously", order_number)
+            try:
+                self.write([(order_number, txn_id, note_msg)])
+            except Exception:
+                self.release(order_number, txn_id)
+                raise
+
+    def start(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    thread = threading.Thread(target=self.run, name='payonline-fail-writer')
+                    thread.daemon = True
+                    thread.start()
+                    self._thread = thread
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.time() + self.interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get(timeout=max(deadline - time.time(), 0)))
+                except Empty:
+                    break
+            try:
+                self.write(batch)
+            except Exception:
+                logger.exception("Can't write failed payments for orders: %s",
+                                 ', '.join(number for number, __, __ in batch))
+                for number, txn_id, __ in batch:
+                    self.release(number, txn_id)
+            finally:
+                close_old_connections()
+
+    def release(self, order_number, txn_id):
+        # the retried notification of the transaction is not coalesced then
+        cache.delete(PayonlineFacade().get_fail_coalesce_key(order_number, txn_id))
+
+    def write(self, batch):
+        # the last failure wins for repeated orders
+        failures = dict((number, (txn_id, note_msg)) for number, txn_id, note_msg in batch)
+        facade = PayonlineFacade()
+        with timed('fail.batch_write'):
+            with transaction.atomic():
+                orders = Order.objects.filter(number__in=list(failures.keys()))
+                found = set()
+                for order in orders:
+                    found.add(order.number)
+                    txn_id, note_msg = failures[order.number]
+                    try:
+                        # every order in its own savepoint, so one failed write
+                        # does not roll back the rest of the batch
+                        with transaction.atomic():
+                            self.set_order_status(order, facade.FAILED_STATUS, note_msg)
+                    except Exception:
+                        logger.exception("Can't write failed payment for order #%s", order.number)
+                        self.release(order.number, txn_id)
+        for number in set(failures) - found:
+            logger.error("Can't find Order #%s for failed transaction", number)
+
+
+failed_payment_writer = FailedPaymentWriter()
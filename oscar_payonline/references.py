@@ -0,0 +1,118 @@
+import os
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.utils.http import int_to_base36, base36_to_int
+from django.utils.module_loading import import_string
+
+from .models import ReferenceNode
+
+REFERENCE_GENERATOR = getattr(settings, 'OSCAR_PAYONLINE_REFERENCE_GENERATOR',
+                              'oscar_payonline.references.RandomReferenceGenerator')
+# must be unique per process generating references (every worker of every host),
+# taken from ReferenceNode table by every process if not set
+REFERENCE_NODE_ID = getattr(settings, 'OSCAR_PAYONLINE_REFERENCE_NODE_ID', None)
+
+
+class ReferenceGenerator(object):
+    """
+    Merchant references look like '<merchant id>-<order number>-<suffix>'
+    """
+
+    def generate(self, merchant_id, number):
+        return u'%s-%s-%s' % (merchant_id, number, self.get_suffix())
+
+    def get_suffix(self):
+        raise NotImplementedError
+
+    def parse(self, ref):
+        """
+        Returns (merchant id, order number, suffix) without DB lookups
+        or None if ref is malformed
+        """
+        parts = ref.rsplit('-', 2)
+        if len(parts) != 3 or not all(parts):
+            return None
+        return tuple(parts)
+
+
+class RandomReferenceGenerator(ReferenceGenerator):
+    """
+    Four random digits, as the references always were.
+    Collisions are possible, so it's only good for low traffic.
+    """
+
+    def __init__(self):
+        self.random = random.SystemRandom()
+
+    def get_suffix(self):
+        return '%04d' % self.random.randrange(10000)
+
+
+class TimeOrderedReferenceGenerator(ReferenceGenerator):
+    """
+    Unique references ordered by time. Suffix is base36-packed 64-bit id of
+    milliseconds since EPOCH (41 bits), node id (10 bits) and
+    per-millisecond sequence (12 bits).
+    Node ids must differ between processes generating references at the same time.
+    Unless a node id is given, every process takes the next id of ReferenceNode
+    table on first use, so ids repeat only after 1024 more processes have started.
+    """
+    EPOCH = 1420070400000  # 2015-01-01 UTC in milliseconds
+    NODE_BITS = 10
+    SEQUENCE_BITS = 12
+
+    def __init__(self, node_id=REFERENCE_NODE_ID):
+        self.allocate = node_id is None
+        self.node_id = None if self.allocate else node_id & ((1 << self.NODE_BITS) - 1)
+        self._pid = None
+        self._lock = threading.Lock()
+        self._last_ms = 0
+        self._sequence = 0
+
+    def next_id(self):
+        max_sequence = (1 << self.SEQUENCE_BITS) - 1
+        with self._lock:
+            if self.allocate and self._pid != os.getpid():
+                # once per process, forked workers take their own id
+                self.node_id = ReferenceNode.objects.create().pk & ((1 << self.NODE_BITS) - 1)
+                self._pid = os.getpid()
+            ms = int(time.time() * 1000)
+            # never go back in time, even if the clock does
+            if ms <= self._last_ms:
+                ms = self._last_ms
+                self._sequence = (self._sequence + 1) & max_sequence
+                if self._sequence == 0:
+                    # sequence is exhausted, borrow the next millisecond
+                    ms += 1
+            else:
+                self._sequence = 0
+            self._last_ms = ms
+            sequence = self._sequence
+        return ((ms - self.EPOCH) << (self.NODE_BITS + self.SEQUENCE_BITS)) | \
+            (self.node_id << self.SEQUENCE_BITS) | sequence
+
+    def get_suffix(self):
+        return int_to_base36(self.next_id())
+
+    def unpack(self, suffix):
+        """
+        Returns (timestamp in milliseconds, node id, sequence) packed in the suffix
+        """
+        value = base36_to_int(suffix)
+        sequence = value & ((1 << self.SEQUENCE_BITS) - 1)
+        node_id = (value >> self.SEQUENCE_BITS) & ((1 << self.NODE_BITS) - 1)
+        ms = (value >> (self.NODE_BITS + self.SEQUENCE_BITS)) + self.EPOCH
+        return ms, node_id, sequence
+
+
+_generator = None
+
+
+def get_reference_generator():
+    global _generator
+    if _generator is None:
+        _generator = import_string(REFERENCE_GENERATOR)()
+    return _generator
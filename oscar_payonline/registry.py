@@ -0,0 +1,61 @@
+from django.db import transaction
+
+from oscar.core.loading import get_model
+from oscar.core.utils import slugify
+
+PaymentEventType = get_model('order', 'PaymentEventType')
+SourceType = get_model('payment', 'SourceType')
+
+SOURCE_TYPE_NAME = 'payonline'
+
+
+class TypeRegistry(object):
+    """
+    Process-local cache of PaymentEventType and SourceType instances.
+    These rows never change after the first insert, so we load them all
+    on first use and fall back to get_or_create for anything not seen yet.
+    Rows are cached only outside of atomic blocks: a row created or seen
+    inside a transaction may be rolled back with it.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def warm_up(self):
+        for event_type in PaymentEventType.objects.all():
+            self._event_types[event_type.name] = event_type
+        # the first one of duplicate names has the plain code
+        for source_type in SourceType.objects.order_by('pk'):
+            self._source_types.setdefault(source_type.name, source_type)
+        self._warm = True
+
+    def clear(self):
+        self._event_types = {}
+        self._source_types = {}
+        self._warm = False
+
+    def _get(self, model, types, name, **lookup):
+        obj = types.get(name)
+        if obj is not None:
+            return obj
+        committed = not transaction.get_connection().in_atomic_block
+        if committed and not self._warm:
+            self.warm_up()
+            obj = types.get(name)
+            if obj is not None:
+                return obj
+        obj, __ = model.objects.get_or_create(defaults={'name': name}, **(lookup or {'name': name}))
+        if committed:
+            types[name] = obj
+        return obj
+
+    def get_event_type(self, name):
+        return self._get(PaymentEventType, self._event_types, name)
+
+    def get_source_type(self, name=SOURCE_TYPE_NAME):
+        # source type names are not unique, so look up by unique code,
+        # otherwise concurrent first callbacks insert duplicates
+        return self._get(SourceType, self._source_types, name, code=slugify(name))
+
+
+registry = TypeRegistry()
@@ -0,0 +1,4 @@
+from django.dispatch import Signal
+
+# sent for every instrumented stage when OSCAR_PAYONLINE_INSTRUMENTATION is on
+stage_timed = Signal(providing_args=['stage', 'duration', 'success'])
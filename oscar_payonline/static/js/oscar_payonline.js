@@ -0,0 +1,50 @@
+var oscar_payonline = (function(o, $) {
+    o.status = {
+        // Polls payonline-status endpoint as often as it asks (Retry-After)
+        // and reloads the page once payment confirmation is received.
+        // Gives up after options.maxWait seconds
+        init: function(url, options) {
+            if ($.isFunction(options)) {
+                options = {onConfirmed: options};
+            }
+            options = options || {};
+            o.status.url = url;
+            o.status.onConfirmed = options.onConfirmed || function() {
+                window.location.reload();
+            };
+            o.status.onTimeout = options.onTimeout || function() {};
+            o.status.deadline = $.now() + (options.maxWait || 120) * 1000;
+            o.status.poll();
+        },
+        poll: function() {
+            $.ajax({
+                url: o.status.url,
+                dataType: 'json',
+                cache: false
+            }).done(function(data, textStatus, xhr) {
+                if (data.confirmed) {
+                    o.status.onConfirmed(data);
+                } else {
+                    o.status.schedule(data.retry_after || xhr.getResponseHeader('Retry-After'));
+                }
+            }).fail(function(xhr) {
+                // nothing to wait for if the reference is not ours
+                if (xhr.status !== 400 && xhr.status !== 403) {
+                    // back off on errors
+                    o.status.schedule(5);
+                }
+            });
+        },
+        schedule: function(seconds) {
+            var delay = (parseInt(seconds, 10) || 5) * 1000;
+            if ($.now() + delay > o.status.deadline) {
+                o.status.onTimeout();
+            } else {
+                setTimeout(o.status.poll, delay);
+            }
+        }
+    };
+
+    return o;
+
+})(oscar_payonline || {}, jQuery);
@@ -0,0 +1,109 @@
+"""
+Local stub of PayOnline search API for tests and benchmarks::
+
+    server = StubPayonlineServer(merchant_id, private_security_key)
+    server.add_transaction(ref, Id=1, Amount='10.00', Currency='RUB', Status='Settled')
+    server.start()
+    client = PayonlineClient(search_url=server.url, ...)
+    ...
+    server.stop()
+"""
+import hashlib
+import threading
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib import urlencode
+    from urlparse import urlparse, parse_qs
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlencode, urlparse, parse_qs
+
+from django.utils.encoding import force_bytes
+
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+    # keep-alive, as the real service does
+    protocol_version = 'HTTP/1.1'
+    # buffer the response, so headers and body go out in one write.
+    # Separate small writes on a kept-alive connection stall on Nagle's algorithm
+    # waiting for the client's delayed ACK (~40ms per request)
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        query = dict((k, v[0]) for k, v in parse_qs(urlparse(self.path).query).items())
+        stub = self.server.stub
+        ref = query.get('OrderId', '')
+        if query.get('MerchantId') != str(stub.merchant_id) or \
+                query.get('SecurityKey') != stub.get_security_key(ref):
+            return self.respond(403, 'Invalid security key')
+        lines = [urlencode(sorted(txn.items())) for txn in stub.get_transactions(ref)]
+        self.respond(200, '\n'.join(lines))
+
+    def respond(self, code, body):
+        body = force_bytes(body)
+        self.send_response(code)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.wfile.flush()
+
+    def log_message(self, *args):
+        pass
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StubPayonlineServer(object):
+
+    def __init__(self, merchant_id, private_security_key, host='127.0.0.1', port=0, lookup=None):
+        self.merchant_id = merchant_id
+        self.private_security_key = private_security_key
+        self.transactions = {}
+        # optional callable ref -> list of transactions, used when ref is not added
+        self.lookup = lookup
+        self.httpd = ThreadingHTTPServer((host, port), StubRequestHandler)
+        self.httpd.stub = self
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return 'http://%s:%s/payment/search/' % (host, port)
+
+    def get_security_key(self, ref):
+        data = 'MerchantId=%s&OrderId=%s&PrivateSecurityKey=%s' % (
+            self.merchant_id, ref, self.private_security_key)
+        return hashlib.md5(force_bytes(data)).hexdigest()
+
+    def add_transaction(self, ref, **data):
+        data.setdefault('OrderId', ref)
+        self.transactions.setdefault(ref, []).append(data)
+
+    def get_transactions(self, ref):
+        if ref in self.transactions:
+            return self.transactions[ref]
+        if self.lookup is not None:
+            return self.lookup(ref)
+        return []
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self.thread is not None:
+            self.thread.join()
@@ -1,5 +1,5 @@
 from django.conf.urls import patterns, url
-from .views import RedirectView, CallbackView, FailView, SuccessView
+from .views import RedirectView, CallbackView, FailView, SuccessView, StatusView, ExportView
 
 
 urlpatterns = patterns(
@@ -7,6 +7,8 @@ urlpatterns = patterns(
     url(r'^$', RedirectView.as_view(), name='payonline-pay'),
     url(r'^callback/$', CallbackView.as_view(), name='payonline-callback'),
     url(r'^fail/$', FailView.as_view(), name='payonline-fail'),
+    url(r'^status/$', StatusView.as_view(), name='payonline-status'),
+    url(r'^export/$', ExportView.as_view(), name='payonline-export'),
     url(r'^success/(?P<order_number>\d+)/$', SuccessView.as_view(), name='payonline-success'),
     url(r'^place-order/(?P<basket_id>\d+)/$', SuccessView.as_view(),
         name='payonline-place-order'),
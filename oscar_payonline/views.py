@@ -1,30 +1,47 @@
 from decimal import Decimal as D
+import hashlib
 import urllib
 import logging
 
 from django.conf import settings
-from django.db.models import Q
+from django.core.cache import cache
+from django.db import transaction, IntegrityError
 from django.http import (HttpResponseBadRequest,
+                         HttpResponseForbidden,
                          HttpResponseRedirect,
-                         HttpResponse)
+                         HttpResponse,
+                         JsonResponse,
+                         StreamingHttpResponse)
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib import messages
 from django.core.urlresolvers import reverse
 from django.shortcuts import render
+from django.utils.encoding import force_bytes
 from django.utils.translation import ugettext as _
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
+from django.views.generic import View
 
 from oscar.core.loading import get_class, get_classes, get_model
 
 from payonline import views as payonline_views
-from payonline.loader import get_fail_backends, get_success_backends
+from payonline.loader import get_fail_backends
 from payonline.settings import CONFIG as PAYONLINE_CONFIG
 from payonline.forms import PaymentDataForm
 from payonline.models import PaymentData
 
 from sitesutils.helpers import get_site
 
-from .facade import PayonlineFacade
+from .facade import (PayonlineFacade, ASYNC_CALLBACK, STATUS_POLL_TIMEOUT, STATUS_POLL_INTERVAL,
+                     FAIL_FAST_PATH, FAIL_COALESCE_TIMEOUT,
+                     REDIRECT_URL_CACHE_TIMEOUT, REDIRECT_URL_CACHE_KEY)
+from .forms import CallbackPaymentDataForm
+from .backends import BackendRunner
+from .export import iter_transactions, parse_date, WRITERS
+from .instrumentation import instrumented
+from .models import CallbackTask
+from .processing import PaymentHandleMixin, CallbackProcessor, failed_payment_writer
+from .registry import registry
 
 from .exceptions import PayOnlineError
 
@@ -33,90 +50,20 @@ ThankYouView = get_class('checkout.views', 'ThankYouView')
 CheckoutSessionMixin = get_class('checkout.session', 'CheckoutSessionMixin')
 InvalidOrderStatus, InvalidPaymentEvent = get_classes('order.exceptions', ('InvalidOrderStatus',
                                                                            'InvalidPaymentEvent'))
-EventHandler = get_class('order.processing', 'EventHandler')
 
 Basket = get_model('basket', 'Basket')
 Order = get_model('order', 'Order')
-Source = get_model('payment', 'Source')
-SourceType = get_model('payment', 'SourceType')
-PaymentEventType = get_model('order', 'PaymentEventType')
-PaymentEvent = get_model('order', 'PaymentEvent')
-PaymentEventQuantity = get_model('order', 'PaymentEventQuantity')
 
 
 logger = logging.getLogger('payonline')
 
+# sites and urls do not change while process runs,
+# so resolve them once: host -> site domain and url name -> path
+_site_domains = {}
+_urls = {}
 
-# the mixin below composed from methods of oscar.apps.checkout.mixins.OrderPlacementMixin
-class PaymentHandleMixin(object):
-
-    def add_payment_source(self, source):
-        """
-        Record a payment source for this order
-        """
-        if self._payment_sources is None:
-            self._payment_sources = []
-        self._payment_sources.append(source)
-
-    def add_payment_event(self, event_type_name, amount, reference=''):
-        """
-        Record a payment event
-        """
-        event_type, __ = PaymentEventType.objects.get_or_create(
-            name=event_type_name)
-        # We keep a local cache of (unsaved) payment events
-        if self._payment_events is None:
-            self._payment_events = []
-
-        event = PaymentEvent(
-            event_type=event_type, amount=amount,
-            reference=reference)
-        if event:
-            self._payment_events.append(event)
-
-    def save_payment_details(self, order):
-        """
-        Saves all payment-related details. This could include a billing
-        address, payment sources and any order payment events.
-        """
-        self.save_payment_events(order)
-        self.save_payment_sources(order)
-
-    def save_payment_events(self, order):
-        """
-        Saves any relevant payment events for this order
-        """
-        if not self._payment_events:
-            return
-        for event in self._payment_events:
-            event.order = order
-            event.save()
-        # We assume all lines are involved in the initial payment event
-        for line in order.lines.all():
-            PaymentEventQuantity.objects.create(
-                event=event, line=line, quantity=line.quantity)
-
-    def save_payment_sources(self, order):
-        """
-        Saves any payment sources used in this order.
-
-        When the payment sources are created, the order model does not exist
-        and so they need to have it set before saving.
-        """
-        if not self._payment_sources:
-            return
-        for source in self._payment_sources:
-            source.order = order
-            source.save()
-
-    def set_order_status(self, order, new_status, note_msg=None):
-        old_status = order.status
-        try:
-            EventHandler().handle_order_status_change(order, new_status, note_msg)
-        except InvalidOrderStatus:
-            logger.error("Can't change order status to: %s. Previous status: %s", new_status, old_status)
-        if order.status == new_status:
-            logger.warning("Order #%s status changed to %s", order.number, new_status)
+# merchant reference the success page waits for, the only one its session may poll
+STATUS_SESSION_KEY = 'payonline_status_ref'
 
 
 class RedirectView(CheckoutSessionMixin, payonline_views.PayView):
@@ -132,15 +79,15 @@ class RedirectView(CheckoutSessionMixin, payonline_views.PayView):
             # assuming it was a frozen order
             # event should be of 'payonline-redirected' type and here we do not check
             #  if previous attempts was finished or not
-            payment_events = self.order.payment_events.all().\
-                filter(Q(event_type__code=self.facade.EVENT_CODE_REDIRECTED) |
-                       Q(event_type__code=self.facade.EVENT_CODE_FAILED) |
-                       Q(event_type__code=self.facade.EVENT_CODE_SUCCESSFUL)).order_by('-date_created')
-            if payment_events.count() > 0:
+            event_types = dict((code, registry.get_event_type(code).pk)
+                               for code in self.facade.get_event_codes())
+            last_event = self.order.payment_events.all().\
+                filter(event_type_id__in=event_types.values()).order_by('-date_created').first()
+            if last_event is not None:
                 # get previously generated reference number if only last redirection not finished
                 # assuming callbacks was not called
-                if payment_events[0].event_type.code == self.facade.EVENT_CODE_REDIRECTED:
-                    self._order_id = payment_events[0].reference
+                if last_event.event_type_id == event_types[self.facade.EVENT_CODE_REDIRECTED]:
+                    self._order_id = last_event.reference
             else:
                 self._order_id = self.facade.merchant_reference(self.order_number)
         return self._order_id
@@ -154,19 +101,36 @@ class RedirectView(CheckoutSessionMixin, payonline_views.PayView):
         return u'%.2f' % float(self.order.total_incl_tax)
     
     def get_redirect_url(self, **kwargs):
-        params = self.get_query_params()
-        return '%s?%s' % (self.get_payonline_url(), urllib.urlencode(params))
+        # signed URL depends on site, order, reference and amount only,
+        # so retries on the same frozen order reuse it
+        key = REDIRECT_URL_CACHE_KEY % hashlib.md5(force_bytes('%s|%s|%s|%s' % (
+            self.request.get_host(), self.order_number,
+            self.payonline_order_id, self.payonline_amount))).hexdigest()
+        url = cache.get(key)
+        if url is None:
+            params = self.get_query_params()
+            url = '%s?%s' % (self.get_payonline_url(), urllib.urlencode(params))
+            cache.set(key, url, REDIRECT_URL_CACHE_TIMEOUT)
+        return url
+
+    def get_site_domain(self):
+        host = self.request.get_host()
+        domain = _site_domains.get(host)
+        if domain is None:
+            domain = _site_domains[host] = get_site(self.request).domain
+        return domain
 
     def get_return_url(self):
-        site = get_site(self.request)
-        return 'http://%s%s?ref=%s' % (site.domain,
+        return 'http://%s%s?ref=%s' % (self.get_site_domain(),
                                        reverse('payonline-success', args=(self.order_number,)),
                                        self.payonline_order_id)
 
     def get_fail_url(self):
-        site = get_site(self.request)
-        return 'http://%s%s' % (site.domain, reverse('payonline-fail'))
+        if 'fail' not in _urls:
+            _urls['fail'] = reverse('payonline-fail')
+        return 'http://%s%s' % (self.get_site_domain(), _urls['fail'])
 
+    @instrumented('redirect')
     def get(self, request, *args, **kwargs):
         # allow order_number to be set via GET request
         self.order_number = getattr(request.GET, 'order_number', None) or self.checkout_session.get_order_number()
@@ -196,35 +160,31 @@ class RedirectView(CheckoutSessionMixin, payonline_views.PayView):
                 self.checkout_session.flush()
                 return HttpResponseRedirect(redirect_url)
 
-            try:
-                # TODO: use EventHandler().handle_order_status_change(self, order, new_status, note_msg=None):
-                self.order.set_status(self.facade.INITIAL_STATUS)
-            except InvalidOrderStatus:
-                logger.error("Can't set initial status for order"
-                             " (order_number=%s, status=%s)",
-                             self.order_number, old_status)
-                messages.error(self.request, _("Can't start to process order #%s. "
-                                               "Is it possible, that you have paid it already?"
-                                               "Please, check order status (%s) and call administrator if "
-                                               "if you need a help") % (self.order_number, old_status))
-                redirect_url = reverse('customer:order', kwargs={'order_number': self.order_number})
-                return HttpResponseRedirect(redirect_url)
-
             logger.info("Started processing PayOnline request"
                         " (order_id=%s, amount=%s, order_number=%s)",
                         self.payonline_order_id, self.payonline_amount, self.order_number)
 
             if self.payonline_order_id:
-                # TODO: move it to facade.freeze_order or smth like
                 try:
-                    self.order.set_status(self.facade.FROZEN_STATUS)
+                    frozen = self.facade.freeze_order(self.order, self.payonline_order_id,
+                                                      self.order.total_incl_tax)
                 except InvalidOrderStatus:
                     logger.error("Can't set FROZEN status for order"
-                                " (order_number=%s, status=%s)",
-                                self.order_number, old_status)
-                    messages.error(self.request, _("Can't freeze order #%s. "
+                                 " (order_number=%s, status=%s)",
+                                 self.order_number, old_status)
+                    messages.error(self.request, _("Can't start to process order #%s. "
+                                                   "Is it possible, that you have paid it already?"
                                                    "Please, check order status (%s) and call administrator if "
-                                                   "if you need a help") % self.order_number, old_status)
+                                                   "if you need a help") % (self.order_number, old_status))
+                    redirect_url = reverse('customer:order', kwargs={'order_number': self.order_number})
+                    return HttpResponseRedirect(redirect_url)
+
+                if not frozen and self.order.status == self.facade.FROZEN_STATUS:
+                    # concurrent request (double click) has frozen the order first,
+                    # so use its reference
+                    self._order_id = ''
+                    self.payonline_order_id = self.get_order_id()
+                    redirect_url = self.get_redirect_url()
 
                 if self.order.status == self.facade.FROZEN_STATUS:
                     logger.info("Order frozen. Redirecting to PayOnline service"
@@ -238,77 +198,74 @@ class RedirectView(CheckoutSessionMixin, payonline_views.PayView):
         return HttpResponseBadRequest()
 
 
-class CallbackView(PaymentHandleMixin, payonline_views.CallbackView):
+class CallbackView(payonline_views.CallbackView):
 
     @method_decorator(csrf_exempt)
     def dispatch(self, *args, **kwargs):
-        self._payment_events = None
-        self._payment_sources = None
         logger.info("Received a call from PayOnline service. Dispatching...")
         return super(CallbackView, self).dispatch(*args, **kwargs)
 
+    def get_private_security_key(self):
+        return PAYONLINE_CONFIG['PRIVATE_SECURITY_KEY']
+
+    def get_form(self, data):
+        # duplicates are caught by unique constraints on save, see process_form
+        return CallbackPaymentDataForm(
+            data=data, private_security_key=self.get_private_security_key())
+
+    @instrumented('callback')
     def process_form(self, form):
         """
         Complete payment with PayOnline - this should compare local txn data
         and PayOnline txn info using API method to capture
         the money from the initial transaction.
-        TODO: remote call to PayOnline
+        In async mode the callback is only saved and queued for callback workers.
+        Retried callbacks are answered with 200 so the gateway stops retrying.
+        Transaction is verified via PayOnline API if OSCAR_PAYONLINE_API_VERIFY is on.
         """
-        order = None
-        facade = PayonlineFacade()
-
         if form.is_valid():
             txn_id = form.cleaned_data.get('transaction_id')
-            if not PaymentData.objects.filter(transaction_id=txn_id).exists():
+            processor = CallbackProcessor()
+            # resolve payment types outside of the transaction, so the registry caches them
+            registry.get_source_type()
+            registry.get_event_type(processor.facade.EVENT_CODE_SUCCESSFUL)
+            # PayOnline API request must not hold the transaction and the task lock
+            verified = ASYNC_CALLBACK or processor.verify(form.instance)
+            with transaction.atomic():
+                try:
+                    # unique transaction_id of the task makes concurrent
+                    # duplicates wait here and fail once the first one commits.
+                    # Only this insert means a duplicate, other integrity errors
+                    # must fail the callback, so the gateway retries it
+                    with transaction.atomic():
+                        task = CallbackTask.objects.create(
+                            transaction_id=txn_id,
+                            status=CallbackTask.PENDING if ASYNC_CALLBACK else CallbackTask.PROCESSING)
+                except IntegrityError as e:
+                    logger.warning("Duplicate callback, transaction already saved (txn_id:%s): %s", txn_id, e)
+                    return HttpResponse()
+                if PaymentData.objects.filter(transaction_id=txn_id).exists():
+                    # saved before the callback tasks were introduced
+                    logger.warning("Duplicate callback, transaction already saved (txn_id:%s)", txn_id)
+                    transaction.set_rollback(True)
+                    return HttpResponse()
                 payment_data = form.save()
 
                 if not getattr(payment_data, 'pk') > 0:
                     logger.error("Can't save payment data received. Txn ID: %s", txn_id)
+                    transaction.set_rollback(True)
                     return HttpResponseBadRequest()
 
-                ref = payment_data.order_id  # meaning payonline's order id which is merchant reference
-                amount = payment_data.amount
-                currency = payment_data.currency
-
-                # TODO: confirm transaction via Payonline API request
-
-                # Record payment source and event
-                source_type, is_created = SourceType.objects.get_or_create(
-                    name='payonline')
-                source = Source(source_type=source_type,
-                                currency=currency,
-                                amount_allocated=amount,
-                                amount_debited=amount,
-                                reference=ref)
-                self.add_payment_source(source)
-                self.add_payment_event(facade.EVENT_CODE_SUCCESSFUL, amount,
-                                       reference=ref)
-
-                # move order to Payment successful status
-                try:
-                    order = facade.validate_order(ref)
-                except PayOnlineError as e:
-                    logger.error(
-                        "Payment event not saved. Can't find order for reference %s: Reason: %s", ref, e)
-                if order:
-                    logger.info(
-                        "Payment event saved for order #%s (type:%s, amount:%s, ref: %s)",
-                        order.number, source_type, amount, ref)
-                    self.save_payment_details(order)
-                    note_msg = _("Successful payment information received from Payonline."
-                                 "Transaction ID: %s. Order status changed" % txn_id)
-                    self.set_order_status(order, facade.SUCCESSFUL_STATUS, note_msg)
-
-                # for backward compatibility
-                backends = get_success_backends()
-                for backend in backends:
-                    backend(payment_data)
-
-                return HttpResponse()
+                if not ASYNC_CALLBACK:
+                    processor.record_payment(payment_data, verified)
+                    task.mark_done()
+
+            PayonlineFacade().cache_transaction_details(payment_data)
+            if ASYNC_CALLBACK:
+                logger.info("Callback queued for processing (txn_id:%s)", txn_id)
             else:
-                logger.error(
-                        "Strange situation! Transaction already saved. Check it! (txn_id:%s)", txn_id)
-                return HttpResponseBadRequest()
+                processor.run_backends(payment_data)
+            return HttpResponse()
         else:
             logger.error("Received invalid callback request! Raw data: %s", form.data)
             return HttpResponseBadRequest()
@@ -328,6 +285,15 @@ class SuccessView(ThankYouView):
                 'payonline_provider': self.txn.provider_name,
                 'payonline_provider_code': self.txn.provider,
             })
+        elif hasattr(self, 'merchant_ref'):
+            # confirmation is not received yet, so let the page wait for it
+            # if the reference belongs to the order of the page
+            parsed = PayonlineFacade().parse_merchant_reference(self.merchant_ref)
+            if parsed is not None and parsed[1] == str(ctx['order'].number):
+                self.request.session[STATUS_SESSION_KEY] = self.merchant_ref
+                ctx['payonline_status_url'] = '%s?%s' % (reverse('payonline-status'),
+                                                         urllib.urlencode({'ref': self.merchant_ref}))
+                ctx['payonline_status_timeout'] = STATUS_POLL_TIMEOUT
         return ctx
 
     def get(self, request, *args, **kwargs):
@@ -361,6 +327,63 @@ class SuccessView(ThankYouView):
         return super(SuccessView, self).get(request, *args, **kwargs)
 
 
+class StatusView(View):
+    """
+    Polled by the success page waiting for payment confirmation.
+    Answers at once after a cache lookup (CallbackView puts PaymentData into cache,
+    evicted entries are read from DB and misses are cached for a few seconds)
+    and tells the client when to poll again, so no worker is held by waiting clients.
+    Only the reference shown on the success page of the session can be polled.
+    """
+
+    def get(self, request, *args, **kwargs):
+        ref = request.GET.get('ref')
+        if not ref:
+            return HttpResponseBadRequest()
+        if ref != request.session.get(STATUS_SESSION_KEY):
+            return HttpResponseForbidden()
+        try:
+            PayonlineFacade().fetch_transaction_details(ref)
+        except PayOnlineError:
+            confirmed = False
+        else:
+            confirmed = True
+        data = {'ref': ref, 'confirmed': confirmed}
+        if not confirmed:
+            data['retry_after'] = STATUS_POLL_INTERVAL
+        response = JsonResponse(data)
+        if not confirmed:
+            response['Retry-After'] = STATUS_POLL_INTERVAL
+        response['Cache-Control'] = 'no-cache'
+        return response
+
+
+class ExportView(View):
+    """
+    Streams PayOnline transactions for accounting as CSV or JSON.
+    GET params: format, from, to (YYYY-MM-DD) and status
+    """
+
+    @method_decorator(staff_member_required)
+    def dispatch(self, *args, **kwargs):
+        return super(ExportView, self).dispatch(*args, **kwargs)
+
+    def get(self, request, *args, **kwargs):
+        export_format = request.GET.get('format', 'csv')
+        if export_format not in WRITERS:
+            return HttpResponseBadRequest()
+        try:
+            date_from = parse_date(request.GET.get('from', ''))
+            date_to = parse_date(request.GET.get('to', ''))
+        except ValueError:
+            return HttpResponseBadRequest()
+        writer, content_type = WRITERS[export_format]
+        rows = iter_transactions(date_from, date_to, request.GET.get('status') or None)
+        response = StreamingHttpResponse(writer(rows), content_type=content_type)
+        response['Content-Disposition'] = 'attachment; filename="payonline-transactions.%s"' % export_format
+        return response
+
+
 class FailView(PaymentHandleMixin, payonline_views.FailView):
     template_name = "oscar_payonline/fail.html"
 
@@ -368,9 +391,12 @@ class FailView(PaymentHandleMixin, payonline_views.FailView):
         return PAYONLINE_CONFIG['PRIVATE_SECURITY_KEY']
 
     def get_form(self, data):
-        return PaymentDataForm(
+        # fast path checks signature only, without unique checks in DB
+        form_class = CallbackPaymentDataForm if FAIL_FAST_PATH else PaymentDataForm
+        return form_class(
             data=data, private_security_key=self.get_private_security_key())
 
+    @instrumented('fail')
     def get(self, request, *args, **kwargs):
         order = None
         if 'ErrorCode' not in request.GET:
@@ -379,6 +405,9 @@ class FailView(PaymentHandleMixin, payonline_views.FailView):
 
         form = self.get_form(request.GET)
 
+        if FAIL_FAST_PATH:
+            return self.get_fast(request, form)
+
         if form.is_valid():
             facade = PayonlineFacade()
             txn_id = form.cleaned_data.get('transaction_id')
@@ -413,13 +442,38 @@ class FailView(PaymentHandleMixin, payonline_views.FailView):
                          "Checksum not valid or something goes wrong. Raw request: %s" % request.GET)
             return HttpResponseBadRequest()
 
+    def get_fast(self, request, form):
+        """
+        Answers the gateway without any DB work: repeated notifications of the same
+        failed transaction are coalesced and the status change is left to the batch writer
+        """
+        if not form.is_valid():
+            logger.error("Received invalid request from Payonline gateway. "
+                         "Checksum not valid or something goes wrong. Raw request: %s" % request.GET)
+            return HttpResponseBadRequest()
+        txn_id = form.cleaned_data.get('transaction_id')
+        err_code = str(request.GET['ErrorCode'])
+        ref_id = form.cleaned_data.get('order_id')
+        order_id = request.GET['order_id']
+        logger.info("Failed PayOnline transaction (txn_id=%s,"
+                    "merchant_reference=%s, error_code=%s)",
+                    txn_id, ref_id, err_code)
+        facade = PayonlineFacade()
+        if not cache.add(facade.get_fail_coalesce_key(order_id, txn_id), 1, FAIL_COALESCE_TIMEOUT):
+            logger.info("Failure for order #%s is already being processed (txn_id=%s)", order_id, txn_id)
+            return HttpResponse()
+        err_msg = facade.get_error_message(err_code)
+        note_msg = _("Payment for order #%(number)s failed. Reason:  %(msg)s" % {'number': order_id,
+                                                                                 'msg': err_msg})
+        failed_payment_writer.put(order_id, txn_id, note_msg)
+        return HttpResponse()
+
     def post(self, request, *args, **kwargs):
         if 'ErrorCode' not in request.POST:
             return HttpResponseBadRequest()
         err_code = request.POST['ErrorCode']
         backends = get_fail_backends()
-        for backend in backends:
-            backend(request, err_code)
+        BackendRunner('fail').run(backends, request, err_code)
         
         return render(request, self.template_name, {
             'error': PayonlineFacade().get_error_message(err_code),
@@ -1,15 +1,25 @@
+import os
 import sys
 
 try:
     from django.conf import settings
 
-    settings.configure(
+    # PostgreSQL is needed for concurrency tests, e.g.
+    # DB_ENGINE=django.db.backends.postgresql_psycopg2 DB_NAME=payonline python runtests.py
+    DATABASE = {
+        "ENGINE": os.environ.get("DB_ENGINE", "django.db.backends.sqlite3"),
+        "NAME": os.environ.get("DB_NAME", ""),
+        "USER": os.environ.get("DB_USER", ""),
+        "PASSWORD": os.environ.get("DB_PASSWORD", ""),
+        "HOST": os.environ.get("DB_HOST", ""),
+        "PORT": os.environ.get("DB_PORT", ""),
+    }
+
+    SETTINGS = dict(
         DEBUG=True,
         USE_TZ=True,
         DATABASES={
-            "default": {
-                "ENGINE": "django.db.backends.sqlite3",
-            }
+            "default": DATABASE,
         },
         ROOT_URLCONF="oscar_payonline.urls",
         INSTALLED_APPS=[
@@ -22,6 +32,79 @@ try:
         NOSE_ARGS=['-s'],
     )
 
+    try:
+        import oscar
+    except ImportError:
+        # without Oscar only tests of modules independent of it are run
+        oscar = None
+    else:
+        from oscar import defaults as oscar_defaults
+
+        SETTINGS.update((name, getattr(oscar_defaults, name))
+                        for name in dir(oscar_defaults) if name.isupper())
+        replica = dict(DATABASE, NAME=DATABASE["NAME"] and DATABASE["NAME"] + "_replica")
+        SETTINGS.update(
+            DATABASES={
+                "default": DATABASE,
+                # separate database for read routing tests
+                "replica": replica,
+            },
+            ROOT_URLCONF="tests.urls",
+            INSTALLED_APPS=[
+                "django.contrib.auth",
+                "django.contrib.admin",
+                "django.contrib.contenttypes",
+                "django.contrib.sessions",
+                "django.contrib.sites",
+                "django.contrib.flatpages",
+                "django.contrib.staticfiles",
+                "compressor",
+                "widget_tweaks",
+                "payonline",
+                "oscar_payonline",
+            ] + oscar.get_core_apps(),
+            MIDDLEWARE_CLASSES=[
+                "django.contrib.sessions.middleware.SessionMiddleware",
+                "django.middleware.csrf.CsrfViewMiddleware",
+                "django.contrib.auth.middleware.AuthenticationMiddleware",
+                "django.contrib.messages.middleware.MessageMiddleware",
+                "oscar.apps.basket.middleware.BasketMiddleware",
+                "oscar_payonline.middleware.FrozenOrderMiddleware",
+            ],
+            TEMPLATE_DIRS=[oscar.OSCAR_MAIN_TEMPLATE_DIR],
+            TEMPLATE_CONTEXT_PROCESSORS=[
+                "django.contrib.auth.context_processors.auth",
+                "django.core.context_processors.request",
+                "django.contrib.messages.context_processors.messages",
+            ],
+            AUTHENTICATION_BACKENDS=[
+                "oscar.apps.customer.auth_backends.EmailBackend",
+                "django.contrib.auth.backends.ModelBackend",
+            ],
+            HAYSTACK_CONNECTIONS={
+                "default": {"ENGINE": "haystack.backends.simple_backend.SimpleEngine"},
+            },
+            PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"],
+            STATIC_URL="/static/",
+            COMPRESS_ENABLED=False,
+            COMPRESS_ROOT="",
+            MEDIA_URL="/media/",
+            OSCAR_INITIAL_ORDER_STATUS="Pending",
+            OSCAR_ORDER_STATUS_PIPELINE={
+                "Pending": ("Frozen for payment", "Cancelled"),
+                "Frozen for payment": ("Successful payment", "Failed payment", "Pending"),
+                "Failed payment": ("Frozen for payment", "Pending", "Cancelled"),
+                "Successful payment": (),
+                "Cancelled": (),
+            },
+            PAYONLINE_CONFIG={
+                "MERCHANT_ID": "1",
+                "PRIVATE_SECURITY_KEY": "secret",
+            },
+        )
+
+    settings.configure(**SETTINGS)
+
     try:
         import django
         setup = django.setup
@@ -0,0 +1,10 @@
+"""
+Tests that need Oscar and django-payonline installed
+(see requirements-test.txt). Skipped without them.
+"""
+import unittest
+
+try:
+    import oscar  # noqa
+except ImportError:
+    raise unittest.SkipTest("django-oscar is not installed")
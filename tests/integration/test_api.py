@@ -0,0 +1,182 @@
+import time
+
+import mock
+
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+
+from oscar.core.loading import get_model
+
+from oscar_payonline import processing
+from oscar_payonline.api import PayonlineClient, CircuitBreaker
+from oscar_payonline.exceptions import PayOnlineAPIError, PayOnlineAPIUnavailable
+from oscar_payonline.facade import PayonlineFacade
+from oscar_payonline.stub import StubPayonlineServer
+
+from .utils import PayonlineTestMixin, callback_data
+
+Order = get_model('order', 'Order')
+
+
+class StubServerMixin(object):
+
+    def setUp(self):
+        super(StubServerMixin, self).setUp()
+        self.server = StubPayonlineServer('1', 'secret').start()
+        self.connections = 0
+        process_request = self.server.httpd.process_request
+
+        def count_connections(*args):
+            self.connections += 1
+            return process_request(*args)
+        self.server.httpd.process_request = count_connections
+
+    def tearDown(self):
+        self.server.stop()
+        super(StubServerMixin, self).tearDown()
+
+    def get_client(self, **kwargs):
+        kwargs.setdefault('backoff', 0)
+        return PayonlineClient(search_url=self.server.url, merchant_id='1',
+                               private_security_key='secret', **kwargs)
+
+
+class ClientTest(StubServerMixin, TestCase):
+
+    def test_get_transaction(self):
+        self.server.add_transaction('1-100-x', Id=5, Amount='10.00', Currency='RUB')
+        client = self.get_client()
+        self.assertEqual(client.get_transaction('1-100-x'),
+                         {'Id': '5', 'Amount': '10.00', 'Currency': 'RUB', 'OrderId': '1-100-x'})
+        self.assertIsNone(client.get_transaction('1-100-y'))
+
+    def test_get_transaction_by_id(self):
+        self.server.add_transaction('1-100-x', Id=5, Status='Declined')
+        self.server.add_transaction('1-100-x', Id=6, Status='Settled')
+        client = self.get_client()
+        self.assertEqual(client.get_transaction('1-100-x', 6)['Status'], 'Settled')
+        self.assertIsNone(client.get_transaction('1-100-x', 7))
+
+    def test_invalid_security_key(self):
+        client = PayonlineClient(search_url=self.server.url, merchant_id='1', private_security_key='wrong')
+        with self.assertRaises(PayOnlineAPIError):
+            client.get_transaction('1-100-x')
+
+    def test_connection_is_kept_alive(self):
+        client = self.get_client()
+        for i in range(10):
+            client.get_transaction('1-100-x')
+        self.assertEqual(self.connections, 1)
+
+    def test_pooled_request_latency(self):
+        # a pooled request is a single local round trip, well below
+        # the delayed ACK stall of responses written in pieces
+        client = self.get_client()
+        client.get_transaction('1-100-x')
+        timings = []
+        for i in range(20):
+            start = time.time()
+            client.get_transaction('1-100-x')
+            timings.append(time.time() - start)
+        self.assertLess(sorted(timings)[len(timings) // 2], 0.02)
+
+    def test_retries_and_opens_circuit(self):
+        breaker = CircuitBreaker(threshold=2, reset_timeout=60)
+        client = PayonlineClient(search_url='http://127.0.0.1:1/', merchant_id='1',
+                                 private_security_key='secret', retries=5, backoff=0,
+                                 timeout=(0.5, 0.5), breaker=breaker)
+        with self.assertRaises(PayOnlineAPIUnavailable):
+            client.get_transaction('1-100-x')
+        self.assertEqual(breaker.failures, 2)
+        with self.assertRaises(PayOnlineAPIUnavailable):
+            client.get_transaction('1-100-x')
+        self.assertEqual(breaker.failures, 2)
+
+
+class CallbackVerificationTest(PayonlineTestMixin, StubServerMixin, TransactionTestCase):
+
+    def setUp(self):
+        super(CallbackVerificationTest, self).setUp()
+        self.order, self.ref = self.create_frozen_order(self.create_user())
+        self.in_transaction = []
+        verify_transaction = PayonlineFacade.verify_transaction
+
+        def verify(facade, txn):
+            self.in_transaction.append(connection.in_atomic_block)
+            return verify_transaction(facade, txn)
+
+        client = self.get_client()
+        for patcher in (mock.patch.object(processing, 'API_VERIFY', True),
+                        mock.patch('oscar_payonline.facade.get_client', return_value=client),
+                        mock.patch.object(PayonlineFacade, 'verify_transaction', verify)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def post(self, amount):
+        return self.client.post(reverse('payonline-callback'), callback_data(self.ref, 4001, amount))
+
+    def test_verified_outside_of_transaction(self):
+        self.server.add_transaction(self.ref, Id=4001, Amount='%.2f' % self.order.total_incl_tax,
+                                    Currency='RUB', Status='Settled')
+        self.assertEqual(self.post(self.order.total_incl_tax).status_code, 200)
+        self.assertEqual(self.in_transaction, [False])
+        self.assertEqual(Order.objects.get(pk=self.order.pk).status, self.facade.SUCCESSFUL_STATUS)
+
+    def test_declined_attempt_before_paid_one(self):
+        # declined attempts keep the merchant reference for the next one
+        amount = '%.2f' % self.order.total_incl_tax
+        self.server.add_transaction(self.ref, Id=4000, Amount=amount, Currency='RUB', Status='Declined')
+        self.server.add_transaction(self.ref, Id=4001, Amount=amount, Currency='RUB', Status='Settled')
+        self.assertEqual(self.post(self.order.total_incl_tax).status_code, 200)
+        self.assertEqual(Order.objects.get(pk=self.order.pk).status, self.facade.SUCCESSFUL_STATUS)
+
+    def test_declined_transaction_is_not_recorded(self):
+        self.server.add_transaction(self.ref, Id=4001, Amount='%.2f' % self.order.total_incl_tax,
+                                    Currency='RUB', Status='Declined')
+        self.assertEqual(self.post(self.order.total_incl_tax).status_code, 200)
+        self.assertEqual(Order.objects.get(pk=self.order.pk).status, self.facade.FROZEN_STATUS)
+
+    def test_suspicious_transaction_is_not_recorded(self):
+        self.assertEqual(self.post(self.order.total_incl_tax).status_code, 200)
+        self.assertEqual(self.in_transaction, [False])
+        self.assertEqual(Order.objects.get(pk=self.order.pk).status, self.facade.FROZEN_STATUS)
+
+
+class VerifyTransactionsTest(PayonlineTestMixin, StubServerMixin, TestCase):
+
+    def setUp(self):
+        super(VerifyTransactionsTest, self).setUp()
+        patcher = mock.patch('oscar_payonline.facade.get_client', return_value=self.get_client())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = self.create_user()
+
+    def add_order(self, *statuses, **kwargs):
+        """
+        Frozen order with PayOnline transactions of the given statuses,
+        the last one saved locally if paid_locally
+        """
+        order, ref = self.create_frozen_order(self.user)
+        amount = '%.2f' % order.total_incl_tax
+        for i, status in enumerate(statuses):
+            self.server.add_transaction(ref, Id=order.pk * 10 + i, Amount=amount,
+                                        Currency='RUB', Status=status)
+        if kwargs.get('paid_locally'):
+            self.client.post(reverse('payonline-callback'),
+                             callback_data(ref, order.pk * 10 + len(statuses) - 1, amount))
+        return ref
+
+    def test_groups(self):
+        declined = self.add_order('Declined')
+        declined_then_paid = self.add_order('Declined', 'Settled', paid_locally=True)
+        paid_not_saved = self.add_order('Declined', 'Settled')
+        not_paid_at_payonline = self.add_order('Declined', 'Declined', paid_locally=True)
+        result = self.facade.verify_transactions(
+            [declined, declined_then_paid, paid_not_saved, not_paid_at_payonline], workers=1, rate=0)
+        self.assertEqual(result, {
+            'confirmed': [declined_then_paid],
+            'suspicious': [not_paid_at_payonline],
+            'missing': [paid_not_saved],
+            'unavailable': [],
+        })
@@ -0,0 +1,79 @@
+from decimal import Decimal as D
+import pickle
+
+import mock
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from oscar.core.loading import get_class, get_model
+from oscar.apps.partner import strategy
+from oscar.test.factories import create_offer, create_product
+
+from oscar_payonline import facade as facade_module
+from oscar_payonline.facade import BASKET_SNAPSHOT_CACHE_KEY
+
+from .utils import PayonlineTestMixin
+
+Applicator = get_class('offer.utils', 'Applicator')
+Basket = get_model('basket', 'Basket')
+StockRecord = get_model('partner', 'StockRecord')
+
+
+class BasketSnapshotTest(PayonlineTestMixin, TestCase):
+
+    def setUp(self):
+        super(BasketSnapshotTest, self).setUp()
+        self.user = self.create_user()
+        self.offer = create_offer()
+        basket = Basket.objects.create(owner=self.user)
+        basket.strategy = strategy.Default()
+        for i in range(5):
+            basket.add_product(create_product(price=D('10.00'), num_in_stock=10))
+        basket.freeze()
+        self.basket_id = basket.id
+        self.request = RequestFactory().get('/')
+        self.request.user = self.user
+        patcher = mock.patch.object(facade_module, 'BASKET_SNAPSHOT', True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def load(self):
+        return self.facade.load_frozen_basket(self.request, self.basket_id)
+
+    def test_restores_discounts_without_applying_offers(self):
+        applied = self.load()
+        with mock.patch.object(Applicator, 'apply') as apply:
+            restored = self.load()
+        self.assertFalse(apply.called)
+        self.assertEqual(restored.total_incl_tax, applied.total_incl_tax)
+        self.assertEqual(restored.total_incl_tax, D('40.00'))
+        self.assertEqual([application['offer'] for application in restored.offer_discounts], [self.offer])
+        self.assertEqual(restored.offer_discounts[0]['discount'], D('10.00'))
+
+    def test_restore_takes_fewer_queries_than_applying_offers(self):
+        with CaptureQueriesContext(connection) as applying:
+            self.load()
+        with CaptureQueriesContext(connection) as restoring:
+            self.load()
+        self.assertLess(len(restoring.captured_queries), len(applying.captured_queries))
+
+    def test_snapshot_holds_plain_values_only(self):
+        self.load()
+        snapshot = pickle.dumps(cache.get(BASKET_SNAPSHOT_CACHE_KEY % self.basket_id), 2)
+        # lines and offers would drag the strategy, request and session along
+        for name in (b'WSGIRequest', b'session', b'strategy', b'Line', b'ConditionalOffer'):
+            self.assertNotIn(name, snapshot)
+
+    def test_offers_are_applied_again_when_prices_change(self):
+        self.load()
+        stockrecord = StockRecord.objects.filter(basket_lines__basket_id=self.basket_id)[0]
+        stockrecord.price_excl_tax = D('20.00')
+        stockrecord.save()
+        with mock.patch.object(Applicator, 'apply', wraps=Applicator().apply) as apply:
+            basket = self.load()
+        self.assertTrue(apply.called)
+        self.assertEqual(basket.total_incl_tax, D('48.00'))
@@ -0,0 +1,193 @@
+"""
+Query count and latency benchmarks of the payment flow hot paths.
+
+Every path runs BENCHMARK_ROUNDS times against BENCHMARK_SCALE seeded orders.
+Queries per request are compared with the baseline stored in benchmarks.json
+per database vendor, so a change adding queries to a hot path fails the build. Latency (p50/p99)
+is reported and checked only if BENCHMARK_LATENCY_TOLERANCE is set, e.g. to 2
+to fail when p50 is twice the stored one. Set BENCHMARK_UPDATE=1 to store
+the current numbers as the new baseline.
+"""
+import json
+import os
+import time
+
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test import TransactionTestCase
+from django.test.client import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth.models import AnonymousUser
+
+from oscar.core.loading import get_model
+
+from oscar_payonline.middleware import FrozenOrderMiddleware
+from oscar_payonline.registry import registry
+
+from .utils import PayonlineTestMixin, callback_data
+
+Order = get_model('order', 'Order')
+PaymentEvent = get_model('order', 'PaymentEvent')
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'benchmarks.json')
+SCALE = int(os.environ.get('BENCHMARK_SCALE', 200))
+ROUNDS = int(os.environ.get('BENCHMARK_ROUNDS', 20))
+UPDATE = bool(os.environ.get('BENCHMARK_UPDATE'))
+LATENCY_TOLERANCE = float(os.environ.get('BENCHMARK_LATENCY_TOLERANCE', 0))
+
+
+def load_baseline():
+    try:
+        with open(BASELINE_PATH) as f:
+            baseline = json.load(f)
+    except IOError:
+        baseline = {}
+    return baseline
+
+
+def store_baseline(name, result):
+    baseline = load_baseline()
+    baseline.setdefault(connection.vendor, {})[name] = result
+    with open(BASELINE_PATH, 'w') as f:
+        json.dump(baseline, f, indent=2, sort_keys=True, separators=(',', ': '))
+        f.write('\n')
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100.0), len(values) - 1)]
+
+
+class PaymentFlowBenchmark(PayonlineTestMixin, TransactionTestCase):
+
+    def setUp(self):
+        super(PaymentFlowBenchmark, self).setUp()
+        self.user = self.create_user()
+        self.seed(SCALE)
+        self.client.login(username='customer', password='secret')
+
+    def seed(self, scale):
+        # other customers' orders with redirection events, so lookups
+        # run against tables of some size. Copies of one order are cheap to insert
+        template = self.create_order()
+        users = [self.create_user('seed%s' % i) for i in range(min(scale, 50))]
+        orders = []
+        for i in range(scale):
+            order = Order(**dict((field.attname, getattr(template, field.attname))
+                                 for field in Order._meta.concrete_fields if not field.primary_key))
+            order.number = 'seed%s' % i
+            order.user = users[i % len(users)]
+            order.status = self.facade.FROZEN_STATUS if i % 2 else self.facade.INITIAL_STATUS
+            orders.append(order)
+        Order.objects.bulk_create(orders)
+        event_type = registry.get_event_type(self.facade.EVENT_CODE_REDIRECTED)
+        PaymentEvent.objects.bulk_create([
+            PaymentEvent(order=order, event_type=event_type, amount=template.total_incl_tax,
+                         reference='1-%s-seed' % order.number)
+            for order in Order.objects.filter(number__startswith='seed')])
+
+    def measure(self, name, prepare, run):
+        """
+        Runs prepare() (not measured) and run() for every round,
+        reports queries and latency and compares them with the baseline
+        """
+        queries, timings = [], []
+        for i in range(ROUNDS):
+            args = prepare(i)
+            with CaptureQueriesContext(connection) as context:
+                start = time.time()
+                run(*args)
+                timings.append((time.time() - start) * 1000)
+            queries.append(len(context.captured_queries))
+        # first round warms up process caches
+        result = {
+            'queries': max(queries[1:]),
+            'p50_ms': round(percentile(timings[1:], 50), 2),
+            'p99_ms': round(percentile(timings[1:], 99), 2),
+        }
+        print("\n%-24s queries: %3d  p50: %7.2f ms  p99: %7.2f ms"
+              % (name, result['queries'], result['p50_ms'], result['p99_ms']))
+        if UPDATE:
+            store_baseline(name, result)
+            return
+        expected = load_baseline().get(connection.vendor, {}).get(name)
+        if expected is None:
+            self.fail("No baseline for %s, run with BENCHMARK_UPDATE=1" % name)
+        self.assertLessEqual(result['queries'], expected['queries'],
+                             "%s issues more queries than the baseline" % name)
+        if LATENCY_TOLERANCE:
+            self.assertLessEqual(result['p50_ms'], expected['p50_ms'] * LATENCY_TOLERANCE,
+                                 "%s is slower than the baseline" % name)
+
+    def set_checkout_session(self, **data):
+        session = self.client.session
+        session.update(data)
+        session.save()
+
+    def test_redirect(self):
+        order = self.create_order(self.user)
+
+        def prepare(i):
+            Order.objects.filter(pk=order.pk).update(status=self.facade.INITIAL_STATUS)
+            self.set_checkout_session(checkout_data={'submission': {'order_number': order.number}})
+            return ()
+
+        def run():
+            response = self.client.get(reverse('payonline-pay'))
+            self.assertEqual(response.status_code, 302)
+
+        self.measure('redirect', prepare, run)
+
+    def test_callback(self):
+        def prepare(i):
+            order, ref = self.create_frozen_order(self.user)
+            return callback_data(ref, 5000 + i, order.total_incl_tax),
+
+        def run(data):
+            response = self.client.post(reverse('payonline-callback'), data)
+            self.assertEqual(response.status_code, 200)
+
+        self.measure('callback', prepare, run)
+
+    def test_fail(self):
+        def prepare(i):
+            order, ref = self.create_frozen_order(self.user)
+            return dict(callback_data(ref, 7000 + i, order.total_incl_tax),
+                        ErrorCode='2', order_id=order.number),
+
+        def run(data):
+            response = self.client.get(reverse('payonline-fail'), data)
+            self.assertEqual(response.status_code, 200)
+
+        self.measure('fail', prepare, run)
+
+    def test_success(self):
+        order, ref = self.create_frozen_order(self.user)
+        self.client.post(reverse('payonline-callback'), callback_data(ref, 9000, order.total_incl_tax))
+        self.set_checkout_session(checkout_order_id=order.pk)
+        url = '%s?ref=%s' % (reverse('payonline-success', args=(order.number,)), ref)
+
+        def run():
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+
+        self.measure('success', lambda i: (), run)
+
+    def middleware_request(self, user):
+        request = RequestFactory().get('/catalogue/')
+        request.user = user
+        FrozenOrderMiddleware().process_request(request)
+        return request,
+
+    def test_middleware_frozen_order(self):
+        self.create_frozen_order(self.user)
+        self.measure('middleware_frozen_order', lambda i: self.middleware_request(self.user),
+                     lambda request: self.assertIsNotNone(request.frozen_order.pk))
+
+    def test_middleware_no_frozen_order(self):
+        self.measure('middleware_no_order', lambda i: self.middleware_request(self.user),
+                     lambda request: self.assertFalse(request.frozen_order))
+
+    def test_middleware_anonymous(self):
+        self.measure('middleware_anonymous', lambda i: self.middleware_request(AnonymousUser()),
+                     lambda request: self.assertFalse(request.frozen_order))
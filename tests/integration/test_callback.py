@@ -0,0 +1,87 @@
+import threading
+
+import mock
+
+from django.core.urlresolvers import reverse
+from django.db import connection, IntegrityError
+from django.test import TestCase, TransactionTestCase, skipUnlessDBFeature
+from django.test.client import Client
+
+from oscar.core.loading import get_model
+
+from payonline.models import PaymentData
+
+from oscar_payonline.models import CallbackTask
+from oscar_payonline.processing import CallbackProcessor
+
+from .utils import PayonlineTestMixin, callback_data
+
+Order = get_model('order', 'Order')
+
+
+class CallbackTest(PayonlineTestMixin, TestCase):
+
+    def setUp(self):
+        super(CallbackTest, self).setUp()
+        self.order, self.ref = self.create_frozen_order(self.create_user())
+        self.data = callback_data(self.ref, 1001, self.order.total_incl_tax)
+
+    def post(self):
+        return self.client.post(reverse('payonline-callback'), self.data)
+
+    def test_records_payment(self):
+        self.assertEqual(self.post().status_code, 200)
+        order = Order.objects.get(pk=self.order.pk)
+        self.assertEqual(order.status, self.facade.SUCCESSFUL_STATUS)
+        self.assertEqual(CallbackTask.objects.get(transaction_id='1001').status, CallbackTask.DONE)
+
+    def test_duplicate_is_answered_with_200(self):
+        self.post()
+        self.assertEqual(self.post().status_code, 200)
+        self.assertEqual(PaymentData.objects.filter(transaction_id=1001).count(), 1)
+        self.assertEqual(self.order.payment_events.filter(
+            event_type__name=self.facade.EVENT_CODE_SUCCESSFUL).count(), 1)
+
+    def test_integrity_error_in_payment_fails_callback(self):
+        with mock.patch.object(CallbackProcessor, 'record_payment', side_effect=IntegrityError('fk')):
+            with self.assertRaises(IntegrityError):
+                self.post()
+        self.assertFalse(PaymentData.objects.filter(transaction_id=1001).exists())
+        self.assertFalse(CallbackTask.objects.filter(transaction_id='1001').exists())
+        # gateway retry succeeds
+        self.assertEqual(self.post().status_code, 200)
+        self.assertEqual(Order.objects.get(pk=self.order.pk).status, self.facade.SUCCESSFUL_STATUS)
+
+
+class ConcurrentCallbackTest(PayonlineTestMixin, TransactionTestCase):
+    threads = 8
+
+    @skipUnlessDBFeature('has_select_for_update')
+    def test_identical_callbacks_record_payment_once(self):
+        order, ref = self.create_frozen_order(self.create_user())
+        data = callback_data(ref, 2001, order.total_incl_tax)
+        start = threading.Event()
+        responses, errors = [], []
+
+        def post():
+            try:
+                start.wait()
+                responses.append(Client().post(reverse('payonline-callback'), data).status_code)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=post) for i in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        start.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(responses, [200] * self.threads)
+        self.assertEqual(PaymentData.objects.filter(transaction_id=2001).count(), 1)
+        self.assertEqual(order.payment_events.filter(
+            event_type__name=self.facade.EVENT_CODE_SUCCESSFUL).count(), 1)
+        self.assertEqual(Order.objects.get(pk=order.pk).status, self.facade.SUCCESSFUL_STATUS)
@@ -0,0 +1,89 @@
+import mock
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TransactionTestCase
+from django.utils import timezone
+from django.utils.six import StringIO
+
+from oscar.core.loading import get_model
+
+from payonline.models import PaymentData
+
+from oscar_payonline.management.commands.payonline_create_indexes import INDEXES
+from oscar_payonline.processing import CallbackProcessor
+
+from .utils import PayonlineTestMixin
+
+Order = get_model('order', 'Order')
+PaymentEvent = get_model('order', 'PaymentEvent')
+
+
+class CreateIndexesTest(TransactionTestCase):
+
+    def tearDown(self):
+        # indexes outlive flush between tests
+        with connection.cursor() as cursor:
+            for model, name, __ in INDEXES:
+                if name in connection.introspection.get_constraints(cursor, model._meta.db_table):
+                    cursor.execute('DROP INDEX %s' % connection.ops.quote_name(name))
+
+    def get_constraints(self, model):
+        with connection.cursor() as cursor:
+            return connection.introspection.get_constraints(cursor, model._meta.db_table)
+
+    def call(self, **options):
+        out = StringIO()
+        call_command('payonline_create_indexes', stdout=out, **options)
+        return out.getvalue()
+
+    def test_creates_indexes_once(self):
+        self.call()
+        self.assertIn('payonline_order_user_status_placed', self.get_constraints(Order))
+        self.assertIn('payonline_paymentevent_ref_type', self.get_constraints(PaymentEvent))
+        self.assertEqual(self.call().count('already exists'), 2)
+
+    def test_dry_run(self):
+        out = self.call(dry_run=True)
+        self.assertEqual(out.count('CREATE INDEX'), 2)
+        self.assertEqual(out.count('CONCURRENTLY'), 2 if connection.vendor == 'postgresql' else 0)
+        self.assertNotIn('payonline_order_user_status_placed', self.get_constraints(Order))
+
+
+class ReconcileTest(PayonlineTestMixin, TransactionTestCase):
+
+    def setUp(self):
+        super(ReconcileTest, self).setUp()
+        user = self.create_user()
+        self.orders = []
+        for txn_id in (7001, 7002):
+            order, ref = self.create_frozen_order(user)
+            PaymentData.objects.create(datetime=timezone.now(), transaction_id=txn_id, order_id=ref,
+                                       amount=order.total_incl_tax, currency='RUB', provider='Card',
+                                       ip_address='127.0.0.1', ip_country='RU')
+            self.orders.append((order, ref))
+
+    def status(self, order):
+        return Order.objects.get(pk=order.pk).status
+
+    def test_failed_order_does_not_stop_reconciliation(self):
+        (broken, broken_ref), (order, __) = self.orders
+        record_payment = CallbackProcessor.record_payment
+        in_transaction = []
+
+        def verify(processor, payment_data):
+            in_transaction.append(connection.in_atomic_block)
+            return True
+
+        def record(processor, payment_data, verified=None):
+            self.assertTrue(verified)
+            if payment_data.order_id == broken_ref:
+                raise ValueError
+            return record_payment(processor, payment_data, verified)
+
+        with mock.patch.object(CallbackProcessor, 'verify', autospec=True, side_effect=verify), \
+                mock.patch.object(CallbackProcessor, 'record_payment', autospec=True, side_effect=record):
+            call_command('payonline_reconcile', stdout=StringIO())
+        self.assertEqual(in_transaction, [False, False])
+        self.assertEqual(self.status(broken), self.facade.FROZEN_STATUS)
+        self.assertEqual(self.status(order), self.facade.SUCCESSFUL_STATUS)
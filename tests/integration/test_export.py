@@ -0,0 +1,29 @@
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from django.utils.six import StringIO
+
+from .utils import PayonlineTestMixin
+
+
+class ExportTest(PayonlineTestMixin, TestCase):
+
+    def setUp(self):
+        super(ExportTest, self).setUp()
+        User.objects.create_superuser('admin', 'admin@example.com', 'secret')
+        self.client.login(username='admin', password='secret')
+
+    def export(self, **params):
+        return self.client.get(reverse('payonline-export'), params)
+
+    def test_exports_date_range(self):
+        response = self.export(**{'from': '2015-01-01', 'to': '2015-01-31'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_malformed_date_is_rejected(self):
+        self.assertEqual(self.export(**{'from': '2015-1-32'}).status_code, 400)
+        self.assertEqual(self.export(**{'to': '01.02.2015'}).status_code, 400)
+        with self.assertRaises(CommandError):
+            call_command('payonline_export', date_from='01.02.2015', stdout=StringIO())
@@ -0,0 +1,60 @@
+import mock
+
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+
+from oscar.core.loading import get_model
+
+from oscar_payonline import views
+from oscar_payonline.processing import FailedPaymentWriter
+
+from .utils import PayonlineTestMixin, callback_data
+
+Order = get_model('order', 'Order')
+
+
+class FailFastPathTest(PayonlineTestMixin, TestCase):
+
+    def setUp(self):
+        super(FailFastPathTest, self).setUp()
+        self.user = self.create_user()
+        self.order, self.ref = self.create_frozen_order(self.user)
+        # write synchronously, the background writer can't see the test transaction
+        writer = FailedPaymentWriter()
+        self.put = mock.Mock(side_effect=lambda *failure: writer.write([failure]))
+        for patcher in (mock.patch.object(views, 'FAIL_FAST_PATH', True),
+                        mock.patch.object(views.failed_payment_writer, 'put', self.put)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def fail(self, txn_id):
+        data = dict(callback_data(self.ref, txn_id, self.order.total_incl_tax),
+                    ErrorCode='2', order_id=self.order.number)
+        return self.client.get(reverse('payonline-fail'), data)
+
+    def status(self):
+        return Order.objects.get(pk=self.order.pk).status
+
+    def test_failure_is_written(self):
+        self.assertEqual(self.fail(8001).status_code, 200)
+        self.assertEqual(self.status(), self.facade.FAILED_STATUS)
+
+    def test_repeated_notification_is_coalesced(self):
+        self.fail(8001)
+        self.assertEqual(self.fail(8001).status_code, 200)
+        self.assertEqual(self.put.call_count, 1)
+
+    def test_decline_after_next_attempt_is_written(self):
+        self.fail(8001)
+        # customer clicks "Pay" again and is declined again at once
+        order = Order.objects.get(pk=self.order.pk)
+        self.facade.freeze_order(order, self.ref, order.total_incl_tax)
+        self.assertEqual(self.status(), self.facade.FROZEN_STATUS)
+        self.assertEqual(self.fail(8002).status_code, 200)
+        self.assertEqual(self.status(), self.facade.FAILED_STATUS)
+
+    def test_invalid_signature(self):
+        data = dict(callback_data(self.ref, 8001, self.order.total_incl_tax),
+                    ErrorCode='2', order_id=self.order.number, SecurityKey='wrong')
+        self.assertEqual(self.client.get(reverse('payonline-fail'), data).status_code, 400)
+        self.assertFalse(self.put.called)
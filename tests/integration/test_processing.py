@@ -0,0 +1,68 @@
+from decimal import Decimal as D
+
+import mock
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from oscar.core.loading import get_class, get_model
+
+from oscar_payonline.processing import CallbackProcessor, FailedPaymentWriter
+
+from .utils import PayonlineTestMixin
+
+EventHandler = get_class('order.processing', 'EventHandler')
+Order = get_model('order', 'Order')
+
+
+class SavePaymentEventsTest(PayonlineTestMixin, TestCase):
+
+    def save_payment_events(self, order):
+        processor = CallbackProcessor()
+        processor.add_payment_event(self.facade.EVENT_CODE_SUCCESSFUL, D('10.00'), reference='ref')
+        with CaptureQueriesContext(connection) as context:
+            processor.save_payment_events(order)
+        return len(context.captured_queries)
+
+    def test_query_count_does_not_depend_on_lines(self):
+        few = self.save_payment_events(self.create_order(lines=1))
+        many = self.save_payment_events(self.create_order(lines=20))
+        self.assertEqual(few, many)
+
+    def test_quantities_cover_all_lines(self):
+        order = self.create_order(lines=3)
+        self.save_payment_events(order)
+        event = order.payment_events.get()
+        self.assertEqual(sorted(event.line_quantities.values_list('line_id', flat=True)),
+                         sorted(order.lines.values_list('pk', flat=True)))
+
+
+class FailedPaymentWriterTest(PayonlineTestMixin, TestCase):
+
+    def setUp(self):
+        super(FailedPaymentWriterTest, self).setUp()
+        self.writer = FailedPaymentWriter()
+        self.order, __ = self.create_frozen_order()
+        self.broken_order, __ = self.create_frozen_order()
+        for order in (self.order, self.broken_order):
+            cache.add(self.facade.get_fail_coalesce_key(order.number, 'txn'), 1)
+        handle_order_status_change = EventHandler.handle_order_status_change
+
+        def handle(handler, order, new_status, note_msg=None):
+            if order.pk == self.broken_order.pk:
+                # aborts the transaction on PostgreSQL
+                connection.cursor().execute('SELECT * FROM payonline_no_such_table')
+            return handle_order_status_change(handler, order, new_status, note_msg)
+        patcher = mock.patch.object(EventHandler, 'handle_order_status_change', handle)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_failed_order_does_not_roll_back_batch(self):
+        self.writer.write([(self.broken_order.number, 'txn', 'failed'), (self.order.number, 'txn', 'failed')])
+        self.assertEqual(Order.objects.get(pk=self.order.pk).status, self.facade.FAILED_STATUS)
+        self.assertEqual(Order.objects.get(pk=self.broken_order.pk).status, self.facade.FROZEN_STATUS)
+        # retried notification of the broken order is written again, others are still coalesced
+        self.assertIsNone(cache.get(self.facade.get_fail_coalesce_key(self.broken_order.number, 'txn')))
+        self.assertEqual(cache.get(self.facade.get_fail_coalesce_key(self.order.number, 'txn')), 1)
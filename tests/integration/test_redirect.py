@@ -0,0 +1,149 @@
+import threading
+
+import mock
+
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, skipUnlessDBFeature
+from django.test.client import Client
+from django.test.client import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from oscar.core.loading import get_class, get_model
+
+from oscar_payonline.views import RedirectView
+
+from .utils import PayonlineTestMixin
+
+InvalidOrderStatus = get_class('order.exceptions', 'InvalidOrderStatus')
+Order = get_model('order', 'Order')
+
+
+class RedirectTestMixin(PayonlineTestMixin):
+
+    def get_order_id(self, order):
+        view = RedirectView()
+        view.request = RequestFactory().get('/')
+        view.order, view.order_number = order, order.number
+        return view.get_order_id()
+
+
+class RedirectTest(RedirectTestMixin, TestCase):
+
+    def setUp(self):
+        super(RedirectTest, self).setUp()
+        self.user = self.create_user()
+        self.client.login(username='customer', password='secret')
+
+    def redirect(self, order):
+        session = self.client.session
+        session['checkout_data'] = {'submission': {'order_number': order.number}}
+        session.save()
+        return self.client.get(reverse('payonline-pay'))
+
+    def test_freezes_order(self):
+        order = self.create_order(self.user)
+        response = self.redirect(order)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Order.objects.get(pk=order.pk).status, self.facade.FROZEN_STATUS)
+
+    def test_paid_order_is_not_frozen(self):
+        order = self.create_order(self.user, status=self.facade.SUCCESSFUL_STATUS)
+        with self.assertRaises(InvalidOrderStatus):
+            self.facade.freeze_order(order, self.facade.merchant_reference(order.number),
+                                     order.total_incl_tax)
+        self.assertEqual(Order.objects.get(pk=order.pk).status, self.facade.SUCCESSFUL_STATUS)
+        self.assertFalse(order.payment_events.exists())
+
+    def test_stale_status_is_not_frozen(self):
+        order = self.create_order(self.user)
+        Order.objects.filter(pk=order.pk).update(status=self.facade.FAILED_STATUS)
+        self.assertFalse(self.facade.freeze_order(order, 'ref', order.total_incl_tax))
+        self.assertEqual(order.status, self.facade.FAILED_STATUS)
+
+    def test_frozen_order_is_not_hidden_by_stale_lookup(self):
+        order = self.create_order(self.user)
+        request = RequestFactory().get('/')
+        request.user = self.user
+
+        def fetch(user, using):
+            # order is frozen while the lookup reads the old status
+            self.facade.freeze_order(order, self.facade.merchant_reference(order.number),
+                                     order.total_incl_tax)
+            return None
+
+        with mock.patch.object(self.facade, '_fetch_frozen_order', side_effect=fetch):
+            self.assertIsNone(self.facade.load_frozen_order(request))
+        self.assertEqual(self.facade.load_frozen_order(request), order)
+
+    def test_repeated_redirect_reuses_reference(self):
+        order, ref = self.create_frozen_order(self.user)
+        self.assertEqual(self.get_order_id(order), ref)
+        self.assertIn(ref, self.redirect(order)['Location'])
+
+
+
+class RedirectQueriesTest(RedirectTestMixin, TransactionTestCase):
+    # payment event types are cached outside of transactions only
+
+    def setUp(self):
+        super(RedirectQueriesTest, self).setUp()
+        self.user = self.create_user()
+
+    def test_get_order_id_is_single_query(self):
+        order, ref = self.create_frozen_order(self.user)
+        # event types are resolved once per process
+        self.get_order_id(order)
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.get_order_id(order), ref)
+        self.assertEqual(len(context.captured_queries), 1)
+
+    def test_new_reference_without_events(self):
+        order = self.create_order(self.user)
+        self.get_order_id(self.create_frozen_order(self.user)[0])
+        with CaptureQueriesContext(connection) as context:
+            ref = self.get_order_id(order)
+        self.assertEqual(len(context.captured_queries), 1)
+        self.assertEqual(self.facade.parse_merchant_reference(ref)[1], order.number)
+
+
+class ConcurrentRedirectTest(PayonlineTestMixin, TransactionTestCase):
+    threads = 8
+
+    @skipUnlessDBFeature('has_select_for_update')
+    def test_double_click_freezes_order_once(self):
+        user = self.create_user()
+        order = self.create_order(user)
+        start = threading.Event()
+        locations, errors = [], []
+
+        def click():
+            try:
+                client = Client()
+                client.login(username='customer', password='secret')
+                session = client.session
+                session['checkout_data'] = {'submission': {'order_number': order.number}}
+                session.save()
+                start.wait()
+                locations.append(client.get(reverse('payonline-pay'))['Location'])
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=click) for i in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        start.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(Order.objects.get(pk=order.pk).status, self.facade.FROZEN_STATUS)
+        events = order.payment_events.filter(event_type__name=self.facade.EVENT_CODE_REDIRECTED)
+        self.assertEqual(events.count(), 1)
+        # every click is sent to PayOnline with the reference of the event
+        ref = events.get().reference
+        self.assertEqual(len(locations), self.threads)
+        for location in locations:
+            self.assertIn(ref, location)
@@ -0,0 +1,46 @@
+from django.db import transaction
+from django.test import TransactionTestCase
+
+from oscar.core.loading import get_model
+
+from oscar_payonline.registry import TypeRegistry
+
+PaymentEventType = get_model('order', 'PaymentEventType')
+SourceType = get_model('payment', 'SourceType')
+
+
+class TypeRegistryTest(TransactionTestCase):
+
+    def setUp(self):
+        self.registry = TypeRegistry()
+
+    def test_caches_committed_rows(self):
+        PaymentEventType.objects.create(name='payonline-redirected')
+        event_type = self.registry.get_event_type('payonline-redirected')
+        source_type = self.registry.get_source_type()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.registry.get_event_type('payonline-redirected'), event_type)
+            self.assertEqual(self.registry.get_source_type(), source_type)
+
+    def test_rolled_back_rows_are_not_cached(self):
+        with transaction.atomic():
+            created = self.registry.get_event_type('payonline-successful')
+            self.assertTrue(PaymentEventType.objects.filter(pk=created.pk).exists())
+            transaction.set_rollback(True)
+        self.assertFalse(PaymentEventType.objects.filter(pk=created.pk).exists())
+        event_type = self.registry.get_event_type('payonline-successful')
+        self.assertTrue(PaymentEventType.objects.filter(pk=event_type.pk).exists())
+
+    def test_rows_seen_in_transaction_are_not_cached(self):
+        PaymentEventType.objects.create(name='payonline-failed')
+        with transaction.atomic():
+            self.registry.get_event_type('payonline-failed')
+        with transaction.atomic():
+            with self.assertNumQueries(1):
+                self.registry.get_event_type('payonline-failed')
+
+    def test_source_type_is_looked_up_by_code(self):
+        SourceType.objects.create(name='payonline', code='payonline')
+        # duplicate name left by concurrent inserts of older versions
+        SourceType.objects.create(name='payonline', code='payonline-2')
+        self.assertEqual(self.registry.get_source_type().code, 'payonline')
@@ -0,0 +1,61 @@
+import mock
+
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from django.db import connections, transaction
+from django.test import TransactionTestCase
+from django.test.client import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from payonline.models import PaymentData
+
+from oscar_payonline import facade as facade_module
+
+from .utils import PayonlineTestMixin, callback_data
+
+
+class ReadRoutingTest(PayonlineTestMixin, TransactionTestCase):
+    """
+    'replica' is a separate database nothing is replicated to,
+    so reads routed to it do not see rows written to the primary
+    """
+    multi_db = True
+
+    def setUp(self):
+        super(ReadRoutingTest, self).setUp()
+        patcher = mock.patch.object(facade_module, 'READ_DATABASE', 'replica')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = self.create_user()
+        self.order, self.ref = self.create_frozen_order(self.user)
+        self.request = RequestFactory().get('/')
+        self.request.user = self.user
+
+    def test_reads_after_write_go_to_primary(self):
+        # freezing the order pins reads of its owner to primary
+        self.assertEqual(self.facade.load_frozen_order(self.request), self.order)
+
+    def test_reads_go_to_replica(self):
+        cache.clear()
+        with CaptureQueriesContext(connections['replica']) as replica:
+            self.assertIsNone(self.facade.load_frozen_order(self.request))
+        self.assertEqual(len(replica.captured_queries), 1)
+
+    def test_reads_in_transaction_go_to_primary(self):
+        cache.clear()
+        with transaction.atomic():
+            self.assertEqual(self.facade.load_frozen_order(self.request), self.order)
+
+    def test_no_frozen_order_marker_is_checked_first(self):
+        cache.set(facade_module.FROZEN_ORDER_CACHE_KEY % self.user.pk, facade_module.NO_FROZEN_ORDER)
+        with mock.patch.object(facade_module.cache, 'get_many') as get_many:
+            self.assertIsNone(self.facade.load_frozen_order(self.request))
+        self.assertFalse(get_many.called)
+
+    def test_transaction_details_after_callback_go_to_primary(self):
+        self.client.post(reverse('payonline-callback'),
+                         callback_data(self.ref, 6001, self.order.total_incl_tax))
+        # callback pins reads of the reference to primary
+        cache.delete(self.facade._transaction_cache_key(self.ref))
+        self.assertEqual(self.facade.fetch_transaction_details(self.ref),
+                         PaymentData.objects.get(order_id=self.ref))
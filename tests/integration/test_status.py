@@ -0,0 +1,89 @@
+import mock
+
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+
+from payonline.models import PaymentData
+
+from oscar_payonline import facade as facade_module
+from oscar_payonline.exceptions import PayOnlineError
+from oscar_payonline.views import STATUS_SESSION_KEY
+
+from .utils import PayonlineTestMixin, callback_data
+
+
+class StatusTest(PayonlineTestMixin, TestCase):
+
+    def setUp(self):
+        super(StatusTest, self).setUp()
+        self.user = self.create_user()
+        self.client.login(username='customer', password='secret')
+        self.order, self.ref = self.create_frozen_order(self.user)
+        session = self.client.session
+        session['checkout_order_id'] = self.order.pk
+        session.save()
+
+    def open_success_page(self, ref):
+        return self.client.get(reverse('payonline-success', args=(self.order.number,)), {'ref': ref})
+
+    def poll(self, ref):
+        return self.client.get(reverse('payonline-status'), {'ref': ref})
+
+    def test_success_page_waits_for_confirmation(self):
+        response = self.open_success_page(self.ref)
+        self.assertIn('payonline_status_url', response.context)
+        self.assertEqual(self.client.session[STATUS_SESSION_KEY], self.ref)
+
+    def test_success_page_does_not_wait_for_other_orders(self):
+        other_order, other_ref = self.create_frozen_order(self.create_user('other'))
+        response = self.open_success_page(other_ref)
+        self.assertNotIn('payonline_status_url', response.context)
+        self.assertEqual(self.poll(other_ref).status_code, 403)
+
+    def test_answers_at_once_until_confirmed(self):
+        self.open_success_page(self.ref)
+        response = self.poll(self.ref)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Retry-After'], '2')
+        self.assertJSONEqual(response.content.decode('utf-8'),
+                             {'ref': self.ref, 'confirmed': False, 'retry_after': 2})
+
+        self.client.post(reverse('payonline-callback'),
+                         callback_data(self.ref, 3001, self.order.total_incl_tax))
+        response = self.poll(self.ref)
+        self.assertFalse(response.has_header('Retry-After'))
+        self.assertJSONEqual(response.content.decode('utf-8'), {'ref': self.ref, 'confirmed': True})
+
+    def test_confirmed_after_cache_eviction(self):
+        self.open_success_page(self.ref)
+        self.client.post(reverse('payonline-callback'),
+                         callback_data(self.ref, 3001, self.order.total_incl_tax))
+        cache.delete(self.facade._transaction_cache_key(self.ref))
+        response = self.poll(self.ref)
+        self.assertJSONEqual(response.content.decode('utf-8'), {'ref': self.ref, 'confirmed': True})
+
+    def test_stale_miss_does_not_replace_confirmation(self):
+        self.client.post(reverse('payonline-callback'),
+                         callback_data(self.ref, 3001, self.order.total_incl_tax))
+        txn = PaymentData.objects.get(order_id=self.ref)
+        cache.delete(self.facade._transaction_cache_key(self.ref))
+
+        def lookup(**kwargs):
+            # callback lands while the poll reads DB
+            self.facade.cache_transaction_details(txn)
+            raise PaymentData.DoesNotExist
+
+        with mock.patch.object(facade_module.PaymentData.objects, 'using') as using:
+            using.return_value.get.side_effect = lookup
+            self.assertRaises(PayOnlineError, self.facade.fetch_transaction_details, self.ref)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.facade.fetch_transaction_details(self.ref), txn)
+
+    def test_reference_of_another_session_is_forbidden(self):
+        self.open_success_page(self.ref)
+        self.client.logout()
+        self.assertEqual(self.poll(self.ref).status_code, 403)
+
+    def test_missing_reference(self):
+        self.assertEqual(self.client.get(reverse('payonline-status')).status_code, 400)
@@ -0,0 +1,71 @@
+from datetime import datetime
+from decimal import Decimal as D
+import itertools
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+
+from oscar.apps.partner import strategy
+from oscar.core.loading import get_model
+from oscar.test.factories import create_order, create_product
+
+from payonline.settings import CONFIG as PAYONLINE_CONFIG
+
+from oscar_payonline.facade import PayonlineFacade
+from oscar_payonline.forms import CallbackPaymentDataForm
+from oscar_payonline.registry import registry
+
+Basket = get_model('basket', 'Basket')
+Order = get_model('order', 'Order')
+
+_numbers = itertools.count(100000)
+
+
+class PayonlineTestMixin(object):
+    """
+    Resets process-wide state (cache and type registry) between tests
+    """
+
+    def setUp(self):
+        super(PayonlineTestMixin, self).setUp()
+        cache.clear()
+        registry.clear()
+        self.facade = PayonlineFacade()
+
+    def create_user(self, username='customer'):
+        return User.objects.create_user(username, '%s@example.com' % username, 'secret')
+
+    def create_order(self, user=None, status=None, lines=1):
+        basket = Basket.objects.create()
+        basket.strategy = strategy.Default()
+        for i in range(lines):
+            basket.add_product(create_product(price=D('10.00'), num_in_stock=10))
+        return create_order(number=str(next(_numbers)), user=user, basket=basket,
+                            status=status or self.facade.INITIAL_STATUS)
+
+    def create_frozen_order(self, user=None, reference=None):
+        order = self.create_order(user)
+        reference = reference or self.facade.merchant_reference(order.number)
+        self.facade.freeze_order(order, reference, order.total_incl_tax)
+        return order, reference
+
+
+def callback_data(reference, transaction_id, amount, currency='RUB', **extra):
+    """
+    Signed PayOnline callback params
+    """
+    data = {
+        'DateTime': datetime(2015, 1, 1, 12).strftime('%Y-%m-%d %H:%M:%S'),
+        'TransactionID': str(transaction_id),
+        'OrderId': reference,
+        'Amount': '%.2f' % D(amount),
+        'Currency': currency,
+        'Provider': 'Card',
+        'IpAddress': '127.0.0.1',
+        'IpCountry': 'RU',
+    }
+    data.update(extra)
+    form = CallbackPaymentDataForm(data=data,
+                                   private_security_key=PAYONLINE_CONFIG['PRIVATE_SECURITY_KEY'])
+    data['SecurityKey'] = form.get_security_key()
+    return data
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_instrumentation
+------------
+
+Tests for `oscar_payonline` instrumentation module.
+"""
+
+import unittest
+
+import mock
+
+from oscar_payonline import instrumentation
+from oscar_payonline.instrumentation import Metrics, instrumented, timed
+from oscar_payonline.signals import stage_timed
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = Metrics(buckets=(0.1, 1))
+
+    def test_observe(self):
+        self.metrics.observe('callback', 0.05)
+        self.metrics.observe('callback', 0.5)
+        self.metrics.observe('callback', 5, success=False)
+        data = self.metrics.snapshot()['callback']
+        self.assertEqual(data['buckets'], [(0.1, 1), (1, 2)])
+        self.assertEqual(data['count'], 3)
+        self.assertAlmostEqual(data['sum'], 5.55)
+        self.assertEqual(data['errors'], 1)
+
+    def test_render_prometheus(self):
+        self.metrics.observe('redirect', 0.5, success=False)
+        text = self.metrics.render_prometheus()
+        self.assertIn('payonline_stage_duration_seconds_bucket{stage="redirect",le="0.1"} 0\n', text)
+        self.assertIn('payonline_stage_duration_seconds_bucket{stage="redirect",le="1"} 1\n', text)
+        self.assertIn('payonline_stage_duration_seconds_bucket{stage="redirect",le="+Inf"} 1\n', text)
+        self.assertIn('payonline_stage_duration_seconds_count{stage="redirect"} 1\n', text)
+        self.assertIn('payonline_stage_errors_total{stage="redirect"} 1\n', text)
+
+    def test_reset(self):
+        self.metrics.observe('redirect', 0.5)
+        self.metrics.reset()
+        self.assertEqual(self.metrics.snapshot(), {})
+
+
+class TestInstrumentation(unittest.TestCase):
+
+    def setUp(self):
+        instrumentation.metrics.reset()
+        self.timings = []
+        stage_timed.connect(self.receiver)
+
+    def tearDown(self):
+        stage_timed.disconnect(self.receiver)
+        instrumentation.metrics.reset()
+
+    def receiver(self, sender, stage, duration, success, **kwargs):
+        self.timings.append((stage, success))
+
+    def test_disabled(self):
+        def func():
+            return 1
+        with mock.patch.object(instrumentation, 'INSTRUMENTATION_ENABLED', False):
+            self.assertIs(instrumented('stage')(func), func)
+            self.assertIs(timed('stage'), instrumentation.NULL_TIMER)
+            with timed('stage'):
+                pass
+        self.assertEqual(self.timings, [])
+        self.assertEqual(instrumentation.metrics.snapshot(), {})
+
+    def test_timed(self):
+        with mock.patch.object(instrumentation, 'INSTRUMENTATION_ENABLED', True):
+            with timed('callback.validate'):
+                pass
+            with self.assertRaises(ValueError):
+                with timed('callback.validate'):
+                    raise ValueError
+        self.assertEqual(self.timings, [('callback.validate', True), ('callback.validate', False)])
+        self.assertEqual(instrumentation.metrics.snapshot()['callback.validate']['errors'], 1)
+
+    def test_instrumented(self):
+        with mock.patch.object(instrumentation, 'INSTRUMENTATION_ENABLED', True):
+            @instrumented('redirect')
+            def redirect(value):
+                return value
+        self.assertEqual(redirect(2), 2)
+        self.assertEqual(redirect.__name__, 'redirect')
+        self.assertEqual(self.timings, [('redirect', True)])
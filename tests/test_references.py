@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_references
+------------
+
+Tests for `oscar_payonline` references module.
+"""
+
+import os
+import threading
+import time
+
+import mock
+
+from django.test import TestCase
+
+from oscar_payonline.models import ReferenceNode
+from oscar_payonline.references import RandomReferenceGenerator, TimeOrderedReferenceGenerator
+
+# references generated by the uniqueness check
+COUNT = int(os.environ.get('REFERENCE_BENCHMARK_COUNT', 1000000))
+
+
+class TestRandomReferenceGenerator(TestCase):
+
+    def test_generate_and_parse(self):
+        generator = RandomReferenceGenerator()
+        ref = generator.generate('1', '100042')
+        self.assertRegexpMatches(ref, r'^1-100042-\d{4}$')
+        self.assertEqual(generator.parse(ref)[:2], ('1', '100042'))
+
+    def test_parse_malformed(self):
+        generator = RandomReferenceGenerator()
+        self.assertIsNone(generator.parse('100042'))
+        self.assertIsNone(generator.parse('1--x'))
+
+
+class TestTimeOrderedReferenceGenerator(TestCase):
+
+    def test_generate_and_parse(self):
+        generator = TimeOrderedReferenceGenerator(node_id=7)
+        ref = generator.generate('1', '100042')
+        merchant_id, number, suffix = generator.parse(ref)
+        self.assertEqual((merchant_id, number), ('1', '100042'))
+        ms, node_id, sequence = generator.unpack(suffix)
+        self.assertEqual(node_id, 7)
+        self.assertAlmostEqual(ms / 1000.0, time.time(), delta=5)
+
+    def test_unique_and_ordered(self):
+        generator = TimeOrderedReferenceGenerator(node_id=1)
+        start = time.time()
+        ids = [generator.next_id() for i in range(COUNT)]
+        elapsed = time.time() - start
+        print("\n%d references: %.2f us per reference" % (COUNT, elapsed * 1e6 / COUNT))
+        self.assertEqual(len(set(ids)), COUNT)
+        self.assertEqual(ids, sorted(ids))
+
+    def test_unique_across_threads(self):
+        generator = TimeOrderedReferenceGenerator(node_id=1)
+        results = [[] for i in range(4)]
+
+        def generate(result):
+            for i in range(10000):
+                result.append(generator.get_suffix())
+
+        threads = [threading.Thread(target=generate, args=(result,)) for result in results]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(set(sum(results, []))), 40000)
+
+    def test_processes_take_own_node_ids(self):
+        first, second = TimeOrderedReferenceGenerator(), TimeOrderedReferenceGenerator()
+        first.next_id()
+        second.next_id()
+        self.assertNotEqual(first.node_id, second.node_id)
+        # once per process
+        first.next_id()
+        self.assertEqual(ReferenceNode.objects.count(), 2)
+
+    def test_forked_process_takes_own_node_id(self):
+        generator = TimeOrderedReferenceGenerator()
+        generator.next_id()
+        node_id = generator.node_id
+        with mock.patch('os.getpid', return_value=os.getpid() + 1):
+            generator.next_id()
+        self.assertNotEqual(generator.node_id, node_id)
+
+    def test_given_node_id(self):
+        generator = TimeOrderedReferenceGenerator(node_id=1025)
+        generator.next_id()
+        self.assertEqual(generator.node_id, 1)
+        self.assertFalse(ReferenceNode.objects.exists())
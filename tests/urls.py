@@ -0,0 +1,8 @@
+from django.conf.urls import include, url
+
+from oscar.app import application
+
+urlpatterns = [
+    url(r'^payonline/', include('oscar_payonline.urls')),
+    url(r'', include(application.urls)),
+]